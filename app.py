@@ -1,428 +1,2626 @@
-import pandas as pd
-from datetime import datetime
+import time
+_MODULE_START = time.perf_counter()
+
+from datetime import datetime, timedelta
 import os
+import sys
 import glob
-from playwright.sync_api import sync_playwright
-import time
-import boto3
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 import io
 import json
 import tempfile
 import shutil
+import base64
+import hashlib
+import re
+import asyncio
+import queue
+import threading
+from urllib.parse import urlparse
+
+# Módulos pesados (pandas, pyarrow, boto3, playwright, requests, bs4) são
+# importados sob demanda com lazy_import(), só nos caminhos que os usam
+_init_timing = {
+    'module_import_s': None,
+    'imports': {},
+    'invocations': 0,
+}
+
+def lazy_import(nome):
+    """
+    Importa um módulo na primeira vez que ele é usado, registrando o tempo gasto
+    """
+    # import_module também para módulos já em sys.modules: se outra thread
+    # ainda está importando o módulo, ele espera a inicialização terminar
+    # (sys.modules sozinho devolveria o módulo pela metade)
+    carregado = nome in sys.modules
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nome)
+    if not carregado:
+        _init_timing['imports'][nome] = round(time.perf_counter() - inicio, 3)
+        print(f"Import de {nome}: {_init_timing['imports'][nome]}s")
+    return modulo
+
+# Instrumentação: cada fase vira um span com duração, emitido como uma linha
+# JSON ('json') ou no Embedded Metric Format do CloudWatch ('emf'); 'off' desliga
+METRICS_FORMAT = os.environ.get('B3_METRICS_FORMAT', 'emf')
+METRICS_NAMESPACE = os.environ.get('B3_METRICS_NAMESPACE', 'B3Scraper')
+# Sondas de diagnóstico da página (iframes, elementos, selects) só com B3_DEBUG=1
+DEBUG_MODE = os.environ.get('B3_DEBUG', '0') == '1'
+
+# Spans da execução atual (zerados a cada invocação do handler)
+_spans = []
+
+# Amostragem de memória: RSS do processo Python e da árvore de processos
+# filhos (driver do Playwright + Chromium), lida de /proc em uma thread
+MEMORY_SAMPLING = os.environ.get('B3_MEMORY_SAMPLING', '1') != '0'
+MEMORY_SAMPLE_MS = int(os.environ.get('B3_MEMORY_SAMPLE_MS', '100'))
+
+# Picos da execução atual (MB) e spans abertos que recebem os picos amostrados
+_memory = {'python_mb': 0.0, 'browser_mb': 0.0, 'total_mb': 0.0, 'samples': 0}
+_open_spans = []
+_memory_sampler = {'thread': None}
+
+def read_rss_kb(pid):
+    """
+    VmRSS de um processo em kB (0 se ele já terminou ou não há /proc)
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for linha in f:
+                if linha.startswith('VmRSS:'):
+                    return int(linha.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def descendant_pids(pid):
+    """
+    PIDs de todos os descendentes de `pid`, montados a partir de /proc/*/stat
+    """
+    filhos = {}
+    for stat in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat) as f:
+                campos = f.read().rsplit(')', 1)[1].split()
+            filhos.setdefault(int(campos[1]), []).append(int(stat.split('/')[2]))
+        except (OSError, ValueError, IndexError):
+            continue
+    descendentes, pendentes = [], [pid]
+    while pendentes:
+        for filho in filhos.get(pendentes.pop(), []):
+            descendentes.append(filho)
+            pendentes.append(filho)
+    return descendentes
+
+def sample_memory():
+    """
+    Lê o RSS atual (MB) do Python e dos processos filhos e atualiza os picos
+    da execução e dos spans abertos
+    """
+    python_mb = read_rss_kb(os.getpid()) / 1024
+    browser_mb = sum(read_rss_kb(pid) for pid in descendant_pids(os.getpid())) / 1024
+    amostra = {'python_mb': python_mb, 'browser_mb': browser_mb, 'total_mb': python_mb + browser_mb}
+    for alvo in [_memory] + [s.memory for s in list(_open_spans)]:
+        for chave, valor in amostra.items():
+            alvo[chave] = round(max(alvo.get(chave, 0.0), valor), 1)
+    _memory['samples'] += 1
+    return amostra
+
+def start_memory_sampler():
+    """
+    Inicia (uma vez por container) a thread que amostra a memória a cada
+    MEMORY_SAMPLE_MS enquanto houver spans abertos
+    """
+    if not MEMORY_SAMPLING or _memory_sampler['thread'] is not None:
+        return
+    
+    def loop():
+        while True:
+            time.sleep(MEMORY_SAMPLE_MS / 1000)
+            if _open_spans:
+                sample_memory()
+    
+    _memory_sampler['thread'] = threading.Thread(target=loop, name='b3-memory-sampler', daemon=True)
+    _memory_sampler['thread'].start()
+
+def reset_memory():
+    _memory.update(python_mb=0.0, browser_mb=0.0, total_mb=0.0, samples=0)
+
+def memory_summary():
+    """
+    Picos de RSS (MB) da execução e o perfil de lançamento em uso
+    """
+    if not MEMORY_SAMPLING:
+        return None
+    return dict(_memory, profile=LAUNCH_PROFILE)
+
+def emit_metric(registro):
+    """
+    Imprime um span no formato configurado (o CloudWatch Logs lê o stdout)
+    """
+    if METRICS_FORMAT == 'emf':
+        metricas = [{'Name': 'duration_ms', 'Unit': 'Milliseconds'}]
+        if 'rss_peak_mb' in registro:
+            # EMF só lê métricas no primeiro nível do registro
+            registro = dict(registro, **{f"rss_{k}": v for k, v in registro['rss_peak_mb'].items()})
+            metricas += [{'Name': f"rss_{k}", 'Unit': 'Megabytes'} for k in registro['rss_peak_mb']]
+        registro = dict(registro, _aws={
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['span']],
+                'Metrics': metricas,
+            }],
+        })
+    if METRICS_FORMAT in ('emf', 'json'):
+        print(json.dumps(registro, default=str))
+
+class span:
+    """
+    Mede uma fase nomeada: `with span('navigation', url=url) as s: ...`.
+    Atributos extras podem ser adicionados dentro do bloco com s.set(chave=valor).
+    """
+
+    def __init__(self, nome, **atributos):
+        self.registro = {'span': nome, **atributos}
+
+    def set(self, **atributos):
+        self.registro.update(atributos)
+
+    def __enter__(self):
+        self.memory = {}
+        if MEMORY_SAMPLING:
+            start_memory_sampler()
+            _open_spans.append(self)
+            sample_memory()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registro['duration_ms'] = round((time.perf_counter() - self._inicio) * 1000, 1)
+        if MEMORY_SAMPLING:
+            sample_memory()
+            _open_spans.remove(self)
+            self.registro['rss_peak_mb'] = {k: self.memory[k] for k in ('python_mb', 'browser_mb', 'total_mb')}
+        self.registro['status'] = 'error' if exc_type else 'ok'
+        if exc_type:
+            self.registro['error'] = exc_type.__name__
+        _spans.append(self.registro)
+        emit_metric(self.registro)
+        return False
+
+def span_summary():
+    """
+    Resumo dos spans da execução: duração total (ms) e ocorrências por nome
+    """
+    resumo = {}
+    for registro in _spans:
+        item = resumo.setdefault(registro['span'], {'duration_ms': 0.0, 'count': 0})
+        item['duration_ms'] = round(item['duration_ms'] + registro['duration_ms'], 1)
+        item['count'] += 1
+        if 'rss_peak_mb' in registro:
+            item['rss_peak_mb'] = max(item.get('rss_peak_mb', 0.0), registro['rss_peak_mb']['total_mb'])
+        if registro['status'] == 'error':
+            item['errors'] = item.get('errors', 0) + 1
+    return resumo
+
+COLUNAS = ["Setor", "Código", "Ação", "Tipo", "Qtde. Teórica", "Part. (%)", "Part. (%)Acum."]
+
+# Base do site (pode apontar para um servidor local com payloads gravados)
+B3_BASE_URL = os.environ.get('B3_BASE_URL', 'https://sistemaswebb3-listados.b3.com.br')
+
+# Tipos das colunas no parquet (números no formato brasileiro viram int64/float64)
+INT_COLUMNS = ['Qtde. Teórica']
+FLOAT_COLUMNS = ['Part. (%)', 'Part. (%)Acum.']
+DICTIONARY_COLUMNS = ['Setor', 'Tipo']
+PARQUET_COMPRESSION = os.environ.get('B3_PARQUET_COMPRESSION', 'snappy')
+
+# Verificação de carteira já ingerida antes de abrir o browser/enviar ao S3
+INGESTION_CHECK = os.environ.get('B3_INGESTION_CHECK', '1') != '0'
+CONTENT_HASH_METADATA = 'content-sha256'
+
+# Layout do dataset: 'flat' (data/b3_data_{data}.parquet) ou 'partitioned'
+# (data/index=IBOV/year=YYYY/month=MM/b3_data_{data}.parquet, estilo Hive)
+DATASET_LAYOUT = os.environ.get('B3_DATASET_LAYOUT', 'flat')
+DATASET_PREFIX = 'data/'
+# Diretório local usado no lugar do bucket S3 (testes/execução local)
+DATASET_ROOT = os.environ.get('B3_DATASET_ROOT')
+COMPACTED_FILENAME = 'compacted.parquet'
+COMPACTION_ROW_GROUP_ROWS = int(os.environ.get('B3_COMPACTION_ROW_GROUP_ROWS', '131072'))
+
+# Diff com o dia anterior: entradas, saídas e mudanças de peso por Código,
+# gravadas em b3_delta_{data}.parquet ao lado do snapshot do dia
+DIFF_ENABLED = os.environ.get('B3_DIFF', '1') != '0'
+SNAPSHOT_CACHE_DIR = '/tmp/b3_snapshots'
+SNAPSHOT_CACHE_KEEP = 2
+
+# Índices aceitos pela página (ex.: IBOV, IBXX, IBXL, SMLL, IDIV)
+DEFAULT_INDEX = 'IBOV'
+MAX_CONCURRENCY = int(os.environ.get('B3_MAX_CONCURRENCY', '4'))
+
+# Lote em pipeline: o browser extrai um índice por vez e os resultados passam
+# por uma fila limitada até as threads que serializam e enviam ao S3
+BATCH_MODE = os.environ.get('B3_BATCH_MODE', 'async')
+BATCH_QUEUE_SIZE = int(os.environ.get('B3_BATCH_QUEUE_SIZE', '2'))
+BATCH_UPLOAD_WORKERS = int(os.environ.get('B3_BATCH_UPLOAD_WORKERS', '2'))
+
+# Chamada XHR que alimenta a tabela da carteira do dia
+PORTFOLIO_API_PATH = '/indexProxy/indexCall/GetPortfolioDay/'
+PORTFOLIO_PAGE_SIZE = int(os.environ.get('B3_PORTFOLIO_PAGE_SIZE', '120'))
+PORTFOLIO_REQUEST_CACHE = '/tmp/b3_portfolio_request.json'
+# Cópia da requisição capturada no bucket, para que um container frio consiga
+# sondar a data (e pular o browser) sem capturar de novo; '' desliga
+PORTFOLIO_REQUEST_S3_KEY = os.environ.get('B3_REQUEST_S3_KEY', 'cache/portfolio_request.json')
+PAGE_CONCURRENCY = int(os.environ.get('B3_PAGE_CONCURRENCY', '4'))
+
+# Botão "próxima página" da paginação da tabela (ngx-pagination)
+PAGINATION_NEXT_SELECTOR = '.pagination-next a'
+
+# Orçamento (ms) de cada fase de espera; cada condição recebe o que restar
+READINESS_BUDGETS_MS = {
+    'load': int(os.environ.get('B3_WAIT_LOAD_MS', '10000')),
+    'interaction': int(os.environ.get('B3_WAIT_INTERACTION_MS', '5000')),
+    'segment': int(os.environ.get('B3_WAIT_SEGMENT_MS', '5000')),
+    'page_size': int(os.environ.get('B3_WAIT_PAGE_SIZE_MS', '8000')),
+    'table': int(os.environ.get('B3_WAIT_TABLE_MS', '10000')),
+    'pagination': int(os.environ.get('B3_WAIT_PAGINATION_MS', '8000')),
+}
+
+# Mapeamento dos campos do JSON da B3 para as colunas da tabela
+PORTFOLIO_FIELDS = ['segment', 'cod', 'asset', 'type', 'theoricalQty', 'part', 'partAcum']
+
+# Script executado dentro da página: devolve, para cada tabela, as linhas de
+# 'tbody tr' e de 'tr' com o texto de cada célula, em uma única chamada
+TABLES_JS = """
+() => Array.from(document.querySelectorAll('table')).map(table => {
+    const rowsToCells = rows => Array.from(rows).map(
+        row => Array.from(row.querySelectorAll('td')).map(cell => (cell.textContent || '').trim())
+    );
+    return [rowsToCells(table.querySelectorAll('tbody tr')), rowsToCells(table.querySelectorAll('tr'))];
+})
+"""
+
+def parse_tables_html(html):
+    """
+    Converte um snapshot HTML no mesmo formato retornado por TABLES_JS
+    """
+    soup = lazy_import('bs4').BeautifulSoup(html, 'html.parser')
+    tabelas = []
+    for table in soup.find_all('table'):
+        variantes = []
+        for rows in (table.select('tbody tr'), table.find_all('tr')):
+            variantes.append([
+                [cell.get_text().strip() for cell in row.find_all('td')]
+                for row in rows
+            ])
+        tabelas.append(variantes)
+    return tabelas
+
+# Seletores de linha de cada variante devolvida por TABLES_JS, na mesma ordem
+ROW_SELECTORS = ['tbody tr', 'tr']
+
+# Linhas de uma única tabela: arg = [índice da tabela, seletor de linha]
+TABLE_ROWS_JS = """
+([tableIdx, rowSelector]) => {
+    const table = document.querySelectorAll('table')[tableIdx];
+    if (!table) return null;
+    return Array.from(table.querySelectorAll(rowSelector)).map(
+        row => Array.from(row.querySelectorAll('td')).map(cell => (cell.textContent || '').trim())
+    );
+}
+"""
+
+def non_empty_rows(linhas):
+    return [linha for linha in linhas if linha and any(cell.strip() for cell in linha)]
+
+def locate_table(tabelas):
+    """
+    Primeira tabela com linhas não vazias, tentando 'tbody tr' antes de 'tr'.
+    Retorna (table_idx, row_selector, dados) ou None.
+    """
+    for table_idx, variantes in enumerate(tabelas):
+        for row_selector, linhas in zip(ROW_SELECTORS, variantes):
+            dados = non_empty_rows(linhas)
+            if dados:
+                return table_idx, row_selector, dados
+    return None
+
+def fit_rows(dados, colunas=COLUNAS):
+    """
+    Ajusta cada linha ao número de colunas (corta o excesso, completa com '')
+    """
+    dados_ajustados = []
+    for linha in dados:
+        if len(linha) >= len(colunas):
+            dados_ajustados.append(linha[:len(colunas)])
+        elif len(linha) > 0:
+            dados_ajustados.append(linha + [''] * (len(colunas) - len(linha)))
+    return dados_ajustados
+
+def dedupe_rows(dados):
+    """
+    Remove linhas repetidas pelo Código (mantém a primeira ocorrência)
+    """
+    vistos = set()
+    unicos = []
+    for linha in dados:
+        codigo = linha[1] if len(linha) > 1 else None
+        if codigo in vistos:
+            continue
+        vistos.add(codigo)
+        unicos.append(linha)
+    if len(unicos) != len(dados):
+        print(f"Removidas {len(dados) - len(unicos)} linhas duplicadas pelo Código")
+    return unicos
+
+def parse_br_number(texto):
+    """
+    Converte número no formato brasileiro ('1.234.567', '12,345') para float
+    """
+    if texto is None:
+        return None
+    texto = str(texto).strip().replace('.', '').replace(',', '.')
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+def parse_dom_footer(rows):
+    """
+    Lê as linhas do rodapé da tabela ("Quantidade Teórica Total" e "Redutor")
+    """
+    resumo = {}
+    for row in rows:
+        for i, cell in enumerate(row):
+            if 'Quantidade Teórica Total' in cell:
+                chave = 'qtde_total'
+            elif 'Redutor' in cell:
+                chave = 'redutor'
+            else:
+                continue
+            valores = [parse_br_number(c) for c in row[i + 1:]]
+            valores = [v for v in valores if v is not None]
+            if valores:
+                resumo[chave] = valores[0]
+            break
+    return resumo
+
+def check_completeness(dados, resumo):
+    """
+    Confere as linhas extraídas contra o total de registros e o rodapé
+    (Quantidade Teórica Total / Redutor)
+    """
+    resumo = resumo or {}
+    qtde_sum = sum(parse_br_number(linha[4]) or 0 for linha in dados if len(linha) > 4)
+    part_sum = sum(parse_br_number(linha[5]) or 0 for linha in dados if len(linha) > 5)
+    checks = []
+    if resumo.get('expected_rows'):
+        checks.append(len(dados) == resumo['expected_rows'])
+    if resumo.get('qtde_total'):
+        checks.append(abs(qtde_sum - resumo['qtde_total']) <= max(1.0, resumo['qtde_total'] * 1e-9))
+    
+    resultado = {
+        'rows': len(dados),
+        'expected_rows': resumo.get('expected_rows'),
+        'qtde_sum': qtde_sum,
+        'qtde_total': resumo.get('qtde_total'),
+        'part_sum': round(part_sum, 3),
+        'redutor': resumo.get('redutor'),
+        'complete': all(checks) if checks else None,
+    }
+    if resultado['complete'] is False:
+        print(f"AVISO: extração incompleta: {resultado}")
+    return resultado
+
+def extract_table_rows(page, engine=None, strategy=None):
+    """
+    Extrai as linhas de todas as tabelas em uma única ida ao browser.
+    engine='evaluate' roda TABLES_JS na página; engine='html' faz um snapshot
+    com page.content() e processa com BeautifulSoup no lado Python.
+    
+    strategy: estratégia aprendida (ver load_page_strategy). Se ela indica a
+    tabela, só essa tabela é lida; se a leitura não passa na validação, a busca
+    completa roda e a estratégia é atualizada.
+    """
+    engine = engine or os.environ.get('B3_TABLE_ENGINE', 'evaluate')
+    print(f"=== Extraindo dados da tabela (engine={engine}) ===")
+    
+    aprendida = (strategy or {}).get('table')
+    if aprendida and engine != 'html':
+        dados = cached_table_rows(page.evaluate(TABLE_ROWS_JS, [aprendida['index'], aprendida['rows']]), aprendida)
+        if dados:
+            return dados
+    
+    if engine == 'html':
+        tabelas = parse_tables_html(page.content())
+    else:
+        tabelas = page.evaluate(TABLES_JS)
+    return learn_table(tabelas, strategy)
+
+async def extract_table_rows_async(page, strategy=None):
+    """
+    extract_table_rows (engine 'evaluate') para o engine assíncrono
+    """
+    aprendida = (strategy or {}).get('table')
+    if aprendida:
+        dados = cached_table_rows(await page.evaluate(TABLE_ROWS_JS, [aprendida['index'], aprendida['rows']]), aprendida)
+        if dados:
+            return dados
+    return learn_table(await page.evaluate(TABLES_JS), strategy)
+
+def cached_table_rows(linhas, aprendida):
+    """
+    Valida as linhas lidas da tabela aprendida (mesmo número de células)
+    """
+    dados = non_empty_rows(linhas or [])
+    if dados and len(dados[0]) == aprendida['cells']:
+        print(f"Dados extraídos da tabela {aprendida['index']} (estratégia em cache): {len(dados)} linhas")
+        return dados
+    print("Tabela da estratégia em cache não validou, refazendo a busca")
+    return None
+
+def learn_table(tabelas, strategy=None):
+    """
+    Busca completa nas tabelas de TABLES_JS, guardando a posição na estratégia
+    """
+    print(f"Total de tabelas encontradas: {len(tabelas)}")
+    encontrada = locate_table(tabelas)
+    if not encontrada:
+        return []
+    table_idx, row_selector, dados = encontrada
+    print(f"Dados extraídos da tabela {table_idx}: {len(dados)} linhas")
+    if strategy is not None:
+        strategy['table'] = {'index': table_idx, 'rows': row_selector, 'cells': len(dados[0])}
+    return dados
+
+_http_session = None
+
+def get_http_session():
+    """
+    Sessão HTTP com pool de conexões, reaproveitada entre invocações
+    """
+    global _http_session
+    if _http_session is None:
+        requests = lazy_import('requests')
+        retry_cls = lazy_import('urllib3.util.retry').Retry
+        session = requests.Session()
+        retry = retry_cls(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _http_session = session
+    return _http_session
+
+def index_url(index=DEFAULT_INDEX):
+    """
+    URL da página da carteira do dia de um índice
+    """
+    return f"{B3_BASE_URL}/indexPage/day/{index}?language=pt-br"
+
+def build_portfolio_url(url, page_number=1, page_size=PORTFOLIO_PAGE_SIZE, index=None):
+    """
+    Reescreve os parâmetros (JSON em base64 no último segmento) da URL da carteira
+    """
+    base, _, encoded = url.rpartition('/')
+    params = json.loads(base64.b64decode(encoded + '=' * (-len(encoded) % 4)))
+    params['pageNumber'] = page_number
+    params['pageSize'] = page_size
+    if index:
+        params['index'] = index
+    encoded = base64.b64encode(json.dumps(params, separators=(',', ':')).encode()).decode()
+    return f"{base}/{encoded}"
+
+def format_portfolio_date(date_text):
+    """
+    Converte a data do cabeçalho do JSON (dd/mm/yy ou dd/mm/yyyy) para dd-mm-yy
+    """
+    for fmt in ("%d/%m/%y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(date_text.strip(), fmt).strftime("%d-%m-%y")
+        except (AttributeError, ValueError):
+            continue
+    return None
+
+def parse_portfolio_payload(payload):
+    """
+    Mapeia o JSON da carteira para (dados, data_formatada, info de paginação)
+    """
+    dados = [
+        [str(item.get(field) or '').strip() for field in PORTFOLIO_FIELDS]
+        for item in payload.get('results') or []
+    ]
+    data_formatada = format_portfolio_date((payload.get('header') or {}).get('date'))
+    return dados, data_formatada, payload.get('page') or {}
+
+def portfolio_summary(payload):
+    """
+    Totais do JSON da carteira usados na conferência de completude
+    """
+    header = payload.get('header') or {}
+    page = payload.get('page') or {}
+    resumo = {
+        'qtde_total': parse_br_number(header.get('theoricalQty')),
+        'redutor': parse_br_number(header.get('reductor')),
+    }
+    if page.get('totalRecords') is not None:
+        resumo['expected_rows'] = int(page['totalRecords'])
+    return {k: v for k, v in resumo.items() if v is not None}
+
+def load_portfolio_request():
+    """
+    Lê a requisição da carteira capturada em uma execução anterior: /tmp
+    (container quente) ou, em um container frio, a cópia no bucket
+    """
+    try:
+        with open(PORTFOLIO_REQUEST_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    if not (PORTFOLIO_REQUEST_S3_KEY and storage_configured()):
+        return None
+    try:
+        captured = json.loads(storage_get(PORTFOLIO_REQUEST_S3_KEY))
+    except Exception as e:
+        print(f"Requisição capturada não encontrada em {PORTFOLIO_REQUEST_S3_KEY}: {type(e).__name__}")
+        return None
+    try:
+        with open(PORTFOLIO_REQUEST_CACHE, 'w') as f:
+            json.dump(captured, f)
+    except OSError:
+        pass
+    return captured
+
+def replay_headers(headers):
+    """
+    Cabeçalhos da requisição capturada que valem a pena repetir
+    """
+    manter = ('user-agent', 'referer', 'accept', 'accept-language')
+    return {k: v for k, v in headers.items() if k.lower() in manter}
+
+def store_portfolio_request(url, headers):
+    """
+    Guarda a requisição capturada para que as próximas execuções dispensem o browser
+    """
+    captured = {'url': url, 'headers': replay_headers(headers)}
+    try:
+        with open(PORTFOLIO_REQUEST_CACHE) as f:
+            inalterada = json.load(f) == captured
+    except (OSError, ValueError):
+        inalterada = False
+    try:
+        with open(PORTFOLIO_REQUEST_CACHE, 'w') as f:
+            json.dump(captured, f)
+    except OSError as e:
+        print(f"Não foi possível salvar a requisição capturada: {e}")
+    if PORTFOLIO_REQUEST_S3_KEY and storage_configured() and not inalterada:
+        try:
+            storage_put(PORTFOLIO_REQUEST_S3_KEY, io.BytesIO(json.dumps(captured).encode('utf-8')))
+        except Exception as e:
+            print(f"Não foi possível salvar a requisição capturada em {PORTFOLIO_REQUEST_S3_KEY}: {e}")
+    return captured
+
+def fetch_portfolio_http(url, headers=None, index=None):
+    """
+    Repete a chamada da carteira via HTTP: lê a primeira página para saber o
+    total e busca as demais em paralelo. Retorna (dados, data_formatada, resumo).
+    """
+    session = get_http_session()
+    
+    def fetch(page_number):
+        response = session.get(build_portfolio_url(url, page_number, index=index), headers=headers or {}, timeout=15)
+        response.raise_for_status()
+        return response.json()
+    
+    primeira = fetch(1)
+    dados, data_formatada, info = parse_portfolio_payload(primeira)
+    total_pages = int(info.get('totalPages') or 1)
+    
+    if total_pages > 1 and dados:
+        print(f"Buscando páginas 2..{total_pages} via HTTP")
+        with ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY) as pool:
+            for payload in pool.map(fetch, range(2, total_pages + 1)):
+                dados.extend(parse_portfolio_payload(payload)[0])
+    
+    return dedupe_rows(dados), data_formatada, portfolio_summary(primeira)
+
+def fetch_index_http(index=None):
+    """
+    Modo HTTP direto: usa a requisição capturada antes e não abre o browser.
+    Retorna (dados, data_formatada, resumo) ou None.
+    """
+    captured = load_portfolio_request()
+    if not captured:
+        print("Nenhuma requisição capturada, modo HTTP indisponível")
+        return None
+    
+    try:
+        print(f"Modo HTTP direto: {captured['url']}")
+        # A requisição guardada pode ser de outro índice (a última capturada)
+        dados, data_formatada, resumo = fetch_portfolio_http(
+            captured['url'], captured.get('headers'), index or DEFAULT_INDEX)
+    except Exception as e:
+        print(f"Erro no modo HTTP direto: {e}")
+        return None
+    
+    if not dados:
+        print("Modo HTTP não retornou dados")
+        return None
+    
+    print(f"Modo HTTP: {len(dados)} registros")
+    return dados, data_formatada or datetime.now().strftime("%d-%m-%y"), resumo
+
+def scrape_b3_http(index=None):
+    """
+    Modo HTTP direto no formato de retorno de scrape_b3_data
+    """
+    with span('http_fetch', index=index or DEFAULT_INDEX) as s:
+        resultado = fetch_index_http(index)
+        s.set(rows=len(resultado[0]) if resultado else 0)
+    if not resultado:
+        return None
+    dados, data_formatada, resumo = resultado
+    record_completeness(dados, resumo)
+    return dados, COLUNAS, data_formatada
+
+def attach_portfolio_capture(page, capturas):
+    """
+    Registra as respostas da chamada da carteira feitas pela própria página
+    """
+    def on_response(response):
+        if PORTFOLIO_API_PATH in response.url and response.ok:
+            capturas.append(response)
+    page.on('response', on_response)
+
+def read_portfolio_capture(capturas):
+    """
+    Lê o JSON capturado; se houver mais páginas, completa via HTTP direto.
+    Retorna (dados, data_formatada, resumo) ou None.
+    """
+    for response in reversed(capturas):
+        try:
+            payload = response.json()
+            dados, data_formatada, info = parse_portfolio_payload(payload)
+        except Exception as e:
+            print(f"Erro ao ler JSON capturado: {e}")
+            continue
+        
+        if not dados:
+            continue
+        
+        captured = store_portfolio_request(response.url, response.request.headers)
+        resumo = portfolio_summary(payload)
+        print(f"JSON da carteira capturado: {len(dados)} registros")
+        
+        if int(info.get('totalPages') or 1) > 1:
+            try:
+                dados_http, data_http, resumo = fetch_portfolio_http(captured['url'], captured['headers'])
+                if dados_http:
+                    dados, data_formatada = dados_http, data_formatada or data_http
+            except Exception as e:
+                print(f"Erro ao completar páginas via HTTP: {e}")
+                continue
+        
+        return dados, data_formatada, resumo
+    
+    return None
+
+# Retorna o nome da primeira condição de carregamento atendida (ou false)
+PAGE_READY_JS = """
+() => {
+    const docs = [document];
+    for (const frame of document.querySelectorAll('iframe')) {
+        try { if (frame.contentDocument) docs.push(frame.contentDocument); } catch (e) {}
+    }
+    for (const doc of docs) {
+        if (Array.from(doc.querySelectorAll('h2')).some(h => h.textContent.includes('Carteira'))) return 'carteira_h2';
+    }
+    if (document.querySelectorAll('table tbody tr').length) return 'table_rows';
+    return false;
+}
+"""
+
+# Verdadeiro quando o número de linhas da tabela não muda há `quietMs`
+ROWS_STABLE_JS = """
+([key, quietMs]) => {
+    const n = document.querySelectorAll('table tbody tr').length;
+    const now = performance.now();
+    const state = window[key] || (window[key] = {n: -1, t: now});
+    if (n !== state.n) { state.n = n; state.t = now; return false; }
+    return n > 0 && now - state.t >= quietMs;
+}
+"""
+
+def wait_ready(fase, condicoes, budget_ms=None):
+    """
+    Espera por condições concretas em vez de sleeps fixos.
+    condicoes: lista de (nome, callable(timeout_ms)) tentadas em ordem; cada
+    uma recebe o orçamento restante da fase. Retorna o nome da condição atendida.
+    """
+    budget_ms = budget_ms if budget_ms is not None else READINESS_BUDGETS_MS.get(fase, 5000)
+    inicio = time.perf_counter()
+    
+    for nome, condicao in condicoes:
+        restante = budget_ms - (time.perf_counter() - inicio) * 1000
+        if restante <= 0:
+            break
+        try:
+            condicao(restante)
+        except Exception as e:
+            readiness_missed(fase, nome, e)
+            continue
+        return readiness_met(fase, nome, inicio)
+    
+    return readiness_gave_up(fase, inicio)
+
+async def wait_ready_async(fase, condicoes, budget_ms=None):
+    """
+    wait_ready para o engine assíncrono: cada condição devolve um awaitable
+    """
+    budget_ms = budget_ms if budget_ms is not None else READINESS_BUDGETS_MS.get(fase, 5000)
+    inicio = time.perf_counter()
+    
+    for nome, condicao in condicoes:
+        restante = budget_ms - (time.perf_counter() - inicio) * 1000
+        if restante <= 0:
+            break
+        try:
+            await condicao(restante)
+        except Exception as e:
+            readiness_missed(fase, nome, e)
+            continue
+        return readiness_met(fase, nome, inicio)
+    
+    return readiness_gave_up(fase, inicio)
+
+def readiness_met(fase, nome, inicio):
+    decorrido = (time.perf_counter() - inicio) * 1000
+    print(f"[readiness] {fase}: '{nome}' atendida em {decorrido:.0f} ms")
+    return nome
+
+def readiness_missed(fase, nome, erro):
+    print(f"[readiness] {fase}: '{nome}' não atendida ({type(erro).__name__})")
+
+def readiness_gave_up(fase, inicio):
+    decorrido = (time.perf_counter() - inicio) * 1000
+    print(f"[readiness] {fase}: nenhuma condição atendida em {decorrido:.0f} ms, seguindo")
+    return None
+
+def wait_rows_stable(page, quiet_ms=500):
+    """
+    Condição: contagem de linhas da tabela estável por `quiet_ms`
+    """
+    def condicao(timeout_ms):
+        key = f"__b3RowsStable{time.monotonic_ns()}"
+        page.wait_for_function(ROWS_STABLE_JS, arg=[key, quiet_ms], polling=100, timeout=timeout_ms)
+    return condicao
 
-def scrape_b3_data():
+def wait_page_ready(page):
+    """
+    Condição: título "Carteira" visível ou primeiras linhas da tabela renderizadas
+    """
+    def condicao(timeout_ms):
+        page.wait_for_function(PAGE_READY_JS, polling=100, timeout=timeout_ms)
+    return condicao
+
+def wait_rows_stable_async(page, quiet_ms=500):
+    def condicao(timeout_ms):
+        key = f"__b3RowsStable{time.monotonic_ns()}"
+        return page.wait_for_function(ROWS_STABLE_JS, arg=[key, quiet_ms], polling=100, timeout=timeout_ms)
+    return condicao
+
+def wait_page_ready_async(page):
+    return lambda timeout_ms: page.wait_for_function(PAGE_READY_JS, polling=100, timeout=timeout_ms)
+
+def select_and_wait(page, select_element, index, fase):
+    """
+    Seleciona a opção e espera a resposta da carteira disparada pela mudança;
+    se ela não vier, espera a tabela estabilizar com o orçamento restante
+    """
+    PlaywrightTimeoutError = lazy_import('playwright.sync_api').TimeoutError
+    budget_ms = READINESS_BUDGETS_MS.get(fase, 5000)
+    inicio = time.perf_counter()
+    try:
+        with page.expect_response(lambda r: PORTFOLIO_API_PATH in r.url, timeout=budget_ms):
+            select_element.select_option(index=index)
+        decorrido = (time.perf_counter() - inicio) * 1000
+        print(f"[readiness] {fase}: 'portfolio_response' atendida em {decorrido:.0f} ms")
+        return 'portfolio_response'
+    except PlaywrightTimeoutError:
+        print(f"[readiness] {fase}: 'portfolio_response' não atendida (TimeoutError)")
+    restante = budget_ms - (time.perf_counter() - inicio) * 1000
+    return wait_ready(fase, [('table_rows_stable', wait_rows_stable(page))], max(restante, 0))
+
+async def select_and_wait_async(page, select_element, index, fase):
+    """
+    select_and_wait para o engine assíncrono
+    """
+    budget_ms = READINESS_BUDGETS_MS.get(fase, 5000)
+    inicio = time.perf_counter()
+    try:
+        async with page.expect_response(lambda r: PORTFOLIO_API_PATH in r.url, timeout=budget_ms):
+            await select_element.select_option(index=index)
+        return readiness_met(fase, 'portfolio_response', inicio)
+    except Exception as e:
+        readiness_missed(fase, 'portfolio_response', e)
+    restante = budget_ms - (time.perf_counter() - inicio) * 1000
+    return await wait_ready_async(fase, [('table_rows_stable', wait_rows_stable_async(page))], max(restante, 0))
+
+# Número total de páginas indicado pela paginação da tabela
+TOTAL_PAGES_JS = """
+() => {
+    const nums = Array.from(document.querySelectorAll('.ngx-pagination li, .pagination li'))
+        .map(li => parseInt((li.textContent || '').replace(/\\D+/g, ''), 10))
+        .filter(n => !isNaN(n));
+    return nums.length ? Math.max(...nums) : 1;
+}
+"""
+
+# Verdadeiro quando a primeira linha da tabela deixa de ser a da página anterior
+PAGE_CHANGED_JS = """
+prev => {
+    const cell = document.querySelector('table tbody tr td:nth-child(2)');
+    return !!cell && cell.textContent.trim() !== prev;
+}
+"""
+
+# Linhas do rodapé (tfoot) das tabelas
+FOOTER_JS = """
+() => Array.from(document.querySelectorAll('table tfoot tr')).map(
+    row => Array.from(row.querySelectorAll('td, th')).map(cell => (cell.textContent || '').trim())
+)
+"""
+
+def collect_dom_pages(page, strategy=None):
+    """
+    Percorre todas as páginas da tabela pelo botão "próxima" e lê o rodapé.
+    Retorna (dados, resumo).
+    """
+    dados = extract_table_rows(page, strategy=strategy)
+    total_pages = page.evaluate(TOTAL_PAGES_JS)
+    print(f"Paginação: {total_pages} página(s)")
+    
+    pagina = dados
+    for page_number in range(2, total_pages + 1):
+        if not pagina:
+            break
+        anterior = pagina[0][1] if len(pagina[0]) > 1 else ''
+        try:
+            page.locator(PAGINATION_NEXT_SELECTOR).first.click()
+        except Exception as e:
+            print(f"Erro ao avançar para a página {page_number}: {e}")
+            break
+        fase = 'pagination'
+        if not wait_ready(fase, [('page_changed', lambda t: page.wait_for_function(
+                PAGE_CHANGED_JS, arg=anterior, polling=100, timeout=t))]):
+            break
+        pagina = extract_table_rows(page, strategy=strategy)
+        dados.extend(pagina)
+    
+    return dados, parse_dom_footer(page.evaluate(FOOTER_JS))
+
+async def collect_dom_pages_async(page, strategy=None):
+    """
+    collect_dom_pages para o engine assíncrono
+    """
+    dados = await extract_table_rows_async(page, strategy)
+    total_pages = await page.evaluate(TOTAL_PAGES_JS)
+    
+    pagina = dados
+    for page_number in range(2, total_pages + 1):
+        if not pagina:
+            break
+        anterior = pagina[0][1] if len(pagina[0]) > 1 else ''
+        try:
+            await page.locator(PAGINATION_NEXT_SELECTOR).first.click()
+        except Exception as e:
+            print(f"Erro ao avançar para a página {page_number}: {e}")
+            break
+        if not await wait_ready_async('pagination', [('page_changed', lambda t: page.wait_for_function(
+                PAGE_CHANGED_JS, arg=anterior, polling=100, timeout=t))]):
+            break
+        pagina = await extract_table_rows_async(page, strategy)
+        dados.extend(pagina)
+    
+    return dados, parse_dom_footer(await page.evaluate(FOOTER_JS))
+
+# Argumentos de lançamento do Chromium otimizados para Lambda
+LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-extensions',
+    '--disable-plugins',
+    '--disable-images',
+    '--disable-default-apps',
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+    '--disable-field-trial-config',
+    '--disable-back-forward-cache',
+    '--disable-ipc-flooding-protection',
+    '--disable-hang-monitor',
+    '--disable-prompt-on-repost',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-features=TranslateUI,VizDisplayCompositor,AudioServiceOutOfProcess',
+    '--hide-scrollbars',
+    '--mute-audio',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--no-zygote',
+    '--single-process',
+    '--disable-breakpad',
+    '--disable-component-extensions-with-background-pages',
+    '--disable-component-update',
+    '--disable-client-side-phishing-detection',
+    '--memory-pressure-off',
+    '--max_old_space_size=4096',
+    '--enable-logging',
+    '--log-level=0',
+    '--data-path=/tmp',
+    '--disk-cache-dir=/tmp',
+    '--homedir=/tmp',
+    '--remote-debugging-port=9222',
+    '--disable-background-networking',
+    '--disable-popup-blocking',
+    '--disable-web-resources',
+    '--enable-automation',
+    '--force-color-profile=srgb',
+    '--metrics-recording-only',
+    '--no-service-autorun',
+    '--password-store=basic',
+    '--use-mock-keychain',
+    '--export-tagged-pdf'
+]
+
+# Flags comuns aos perfis enxutos: sem sandbox/GPU/serviços em segundo plano
+# e com perfil, cache e logs limitados ao /tmp
+BASE_LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-breakpad',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-component-extensions-with-background-pages',
+    '--disable-client-side-phishing-detection',
+    '--disable-back-forward-cache',
+    '--hide-scrollbars',
+    '--mute-audio',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--no-service-autorun',
+    '--password-store=basic',
+    '--use-mock-keychain',
+    '--data-path=/tmp',
+    '--disk-cache-dir=/tmp',
+    '--homedir=/tmp',
+]
+
+# Perfis de lançamento (B3_LAUNCH_PROFILE):
+# - minimal: processo único, heap de JS pequeno e caches mínimos, para os
+#   menores tamanhos de memória da Lambda
+# - balanced: sem zygote, no máximo dois renderers e heap moderado
+# - robust: os argumentos históricos (LAUNCH_ARGS), com folga de memória
+LAUNCH_PROFILES = {
+    'minimal': BASE_LAUNCH_ARGS + [
+        '--single-process',
+        '--no-zygote',
+        '--renderer-process-limit=1',
+        '--disable-features=site-per-process,TranslateUI,AudioServiceOutOfProcess,BackForwardCache',
+        '--js-flags=--max-old-space-size=128',
+        '--disk-cache-size=1',
+        '--media-cache-size=1',
+        '--aggressive-cache-discard',
+        '--disable-software-rasterizer',
+    ],
+    'balanced': BASE_LAUNCH_ARGS + [
+        '--no-zygote',
+        '--renderer-process-limit=2',
+        '--disable-features=TranslateUI,AudioServiceOutOfProcess',
+        '--js-flags=--max-old-space-size=512',
+        '--disk-cache-size=33554432',
+    ],
+    'robust': LAUNCH_ARGS,
+}
+LAUNCH_PROFILE = os.environ.get('B3_LAUNCH_PROFILE', 'robust')
+
+def launch_args(profile=None):
+    """
+    Argumentos do Chromium para o perfil pedido (ou B3_LAUNCH_PROFILE)
+    """
+    profile = profile or LAUNCH_PROFILE
+    if profile not in LAUNCH_PROFILES:
+        print(f"Perfil de lançamento desconhecido '{profile}', usando 'robust'")
+        profile = 'robust'
+    return LAUNCH_PROFILES[profile]
+
+# Path do Chromium resolvido no build da imagem (ver Dockerfile)
+CHROMIUM_PATH_FILE = '/var/task/.chromium_path'
+
+# Paths possíveis para o Chromium em diferentes ambientes
+CHROMIUM_PATHS = [
+    '/var/task/browsers/chromium-*/chrome-linux/chrome',
+    '/var/task/.playwright/chromium-*/chrome-linux/chrome',
+    '/root/.cache/ms-playwright/chromium-*/chrome-linux/chrome',
+    '/home/pwuser/.cache/ms-playwright/chromium-*/chrome-linux/chrome'
+]
+
+# Limites de reaproveitamento do browser entre invocações do mesmo container
+BROWSER_REUSE = os.environ.get('B3_BROWSER_REUSE', '1') != '0'
+BROWSER_MAX_USES = int(os.environ.get('B3_BROWSER_MAX_USES', '20'))
+BROWSER_MAX_AGE_S = int(os.environ.get('B3_BROWSER_MAX_AGE_S', '900'))
+
+# Filtro de requisições: tipos de recurso abortados e domínios permitidos
+REQUEST_BLOCKING = os.environ.get('B3_REQUEST_BLOCKING', '1') != '0'
+BLOCKED_RESOURCE_TYPES = set(filter(None, os.environ.get(
+    'B3_BLOCKED_RESOURCE_TYPES', 'image,stylesheet,font,media,manifest').split(',')))
+ALLOWED_DOMAINS = set(filter(None, os.environ.get('B3_ALLOWED_DOMAINS', 'b3.com.br').split(',')))
+ALLOWED_DOMAINS.add(urlparse(B3_BASE_URL).hostname)
+
+# Contadores de rede da execução atual
+_network_stats = {}
+
+# Conferência de completude da última extração
+_completeness = {}
+
+# Estado do browser mantido entre invocações (container "quente")
+_browser = {
+    'playwright': None,
+    'context': None,
+    'temp_dir': None,
+    'started_at': None,
+    'uses': 0,
+    'last_start': None,
+}
+
+_chrome_executable = {}
+
+def find_chrome_executable():
+    """
+    Procura o executável do Chromium uma vez por container: variável
+    B3_CHROMIUM_PATH, arquivo gerado no build e, por último, os paths conhecidos
+    """
+    if 'path' in _chrome_executable:
+        return _chrome_executable['path']
+    
+    path = os.environ.get('B3_CHROMIUM_PATH')
+    if not path and os.path.exists(CHROMIUM_PATH_FILE):
+        with open(CHROMIUM_PATH_FILE) as f:
+            path = f.read().strip()
+    if path and not os.path.exists(path):
+        path = None
+    if not path:
+        for pattern in CHROMIUM_PATHS:
+            matches = glob.glob(pattern)
+            if matches:
+                path = matches[0]
+                break
+    
+    if path:
+        print(f"Encontrado Chromium em: {path}")
+    _chrome_executable['path'] = path
+    return path
+
+def cleanup_profile_dirs():
+    """
+    Remove diretórios de perfil do Playwright deixados em /tmp
+    """
+    for path in glob.glob('/tmp/playwright_*'):
+        shutil.rmtree(path, ignore_errors=True)
+
+def browser_healthy():
+    """
+    Verifica se o contexto ainda responde e se está dentro dos limites de reuso
+    """
+    context = _browser['context']
+    if context is None:
+        return False
+    if _browser['uses'] >= BROWSER_MAX_USES:
+        print(f"Browser atingiu {_browser['uses']} usos, relançando")
+        return False
+    if time.time() - _browser['started_at'] >= BROWSER_MAX_AGE_S:
+        print(f"Browser com mais de {BROWSER_MAX_AGE_S}s, relançando")
+        return False
+    try:
+        # Ida e volta ao browser: falha se o Chromium caiu
+        context.cookies()
+        return True
+    except Exception as e:
+        print(f"Browser não responde ({e}), relançando")
+        return False
+
+def record_completeness(dados, resumo):
+    """
+    Confere a extração e guarda o resultado para a resposta do handler
+    """
+    _completeness.clear()
+    _completeness.update(check_completeness(dados, resumo))
+    print(f"Completude: {_completeness}")
+    return _completeness
+
+def new_network_stats():
+    """
+    Contadores zerados de requisições permitidas/bloqueadas
+    """
+    return {
+        'allowed': 0,
+        'allowed_bytes': 0,
+        'blocked': 0,
+        'blocked_by_type': {},
+        'blocked_by_domain': {},
+    }
+
+def reset_network_stats():
+    """
+    Zera os contadores de requisições da execução
+    """
+    _network_stats.clear()
+    _network_stats.update(new_network_stats())
+
+def domain_allowed(hostname):
+    """
+    Verifica se o host pertence a um dos domínios permitidos (ou subdomínio)
+    """
+    if not hostname:
+        return True
+    return any(hostname == d or hostname.endswith('.' + d) for d in ALLOWED_DOMAINS)
+
+def block_reason(request, stats):
+    """
+    Decide se a requisição deve ser abortada e atualiza os contadores em `stats`
+    """
+    hostname = urlparse(request.url).hostname
+    if request.resource_type in BLOCKED_RESOURCE_TYPES:
+        motivo = ('blocked_by_type', request.resource_type)
+    elif not domain_allowed(hostname):
+        motivo = ('blocked_by_domain', hostname)
+    else:
+        if stats:
+            stats['allowed'] += 1
+        return None
+    if stats:
+        stats['blocked'] += 1
+        contagem = stats[motivo[0]]
+        contagem[motivo[1]] = contagem.get(motivo[1], 0) + 1
+    return motivo
+
+def count_response_bytes(stats, sizes, headers=None):
+    """
+    Soma o corpo das respostas permitidas: responseBodySize do request
+    finalizado (vale para respostas chunked ou comprimidas, que não trazem
+    content-length); o content-length só é usado se o tamanho não veio
+    """
+    if not stats:
+        return
+    tamanho = (sizes or {}).get('responseBodySize')
+    if tamanho is None or tamanho < 0:
+        tamanho = int((headers or {}).get('content-length') or 0)
+    stats['allowed_bytes'] += tamanho
+
+def install_request_filter(context):
+    """
+    Aborta recursos não essenciais (tipos bloqueados e domínios de terceiros)
+    e contabiliza o tráfego permitido/bloqueado
+    """
+    def on_route(route):
+        if block_reason(route.request, _network_stats):
+            route.abort()
+        else:
+            route.continue_()
+    
+    def on_finished(request):
+        if not _network_stats:
+            return
+        sizes = headers = None
+        try:
+            sizes = request.sizes()
+        except Exception:
+            try:
+                headers = request.response().headers
+            except Exception:
+                pass
+        count_response_bytes(_network_stats, sizes, headers)
+    
+    context.route('**/*', on_route)
+    context.on('requestfinished', on_finished)
+
+async def install_request_filter_async(context, stats):
+    """
+    Versão assíncrona do filtro de requisições (playwright.async_api)
+    """
+    async def on_route(route):
+        if block_reason(route.request, stats):
+            await route.abort()
+        else:
+            await route.continue_()
+    
+    async def on_finished(request):
+        sizes = headers = None
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            try:
+                headers = (await request.response()).headers
+            except Exception:
+                pass
+        count_response_bytes(stats, sizes, headers)
+    
+    await context.route('**/*', on_route)
+    context.on('requestfinished', on_finished)
+
+def shutdown_browser():
+    """
+    Fecha contexto e Playwright e remove o perfil em /tmp
+    """
+    if _browser['context'] is not None:
+        try:
+            _browser['context'].close()
+        except Exception:
+            pass
+    if _browser['playwright'] is not None:
+        try:
+            _browser['playwright'].stop()
+        except Exception:
+            pass
+    if _browser['temp_dir']:
+        shutil.rmtree(_browser['temp_dir'], ignore_errors=True)
+    _browser.update(playwright=None, context=None, temp_dir=None, started_at=None, uses=0)
+
+def acquire_browser_context():
+    """
+    Devolve o contexto persistente, reaproveitando o da invocação anterior
+    quando saudável (warm start) ou lançando um novo (cold start)
+    """
+    inicio = time.perf_counter()
+    
+    if _browser['context'] is not None and not browser_healthy():
+        shutdown_browser()
+    
+    if _browser['context'] is None:
+        cleanup_profile_dirs()
+        chrome_executable = find_chrome_executable()
+        if chrome_executable:
+            print(f"Usando executável: {chrome_executable}")
+        else:
+            print("Usando Chromium padrão do sistema")
+        
+        # Definir variáveis de ambiente específicas para o Chrome
+        os.environ['CHROME_DEVEL_SANDBOX'] = '/usr/local/sbin/chrome-devel-sandbox'
+        os.environ['DISPLAY'] = ':99'
+        
+        # Criar diretório temporário único para user data
+        temp_dir = tempfile.mkdtemp(prefix="playwright_", dir="/tmp")
+        playwright = lazy_import('playwright.sync_api').sync_playwright().start()
+        try:
+            print(f"Lançando browser com contexto persistente (perfil {LAUNCH_PROFILE})...")
+            context = playwright.chromium.launch_persistent_context(
+                user_data_dir=temp_dir,
+                headless=True,
+                args=launch_args(),
+                executable_path=chrome_executable
+            )
+        except Exception:
+            playwright.stop()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        
+        if REQUEST_BLOCKING:
+            install_request_filter(context)
+        
+        _browser.update(playwright=playwright, context=context, temp_dir=temp_dir,
+                        started_at=time.time(), uses=0)
+        start = 'cold'
+    else:
+        start = 'warm'
+    
+    _browser['uses'] += 1
+    _browser['last_start'] = {
+        'start': start,
+        'seconds': round(time.perf_counter() - inicio, 3),
+        'uses': _browser['uses'],
+    }
+    print(f"Browser/contexto pronto ({start} start) em {_browser['last_start']['seconds']}s")
+    return _browser['context']
+
+def release_page(page):
+    """
+    Fecha a página; o contexto fica aberto para a próxima invocação
+    (ou é encerrado se o reuso estiver desligado)
+    """
+    try:
+        page.close()
+    except Exception:
+        pass
+    if not BROWSER_REUSE:
+        shutdown_browser()
+
+# Selects de segmento e de tamanho de página (id ou name)
+SEGMENT_SELECTOR = 'select#segment, select[name*="segment"]'
+PAGE_SIZE_SELECTOR = 'select#selectPage, select[name*="page"]'
+# (seletor, opção escolhida, fase de espera) de cada select, em ordem
+INTERACTION_SELECTS = [(SEGMENT_SELECTOR, 1, 'segment'), (PAGE_SIZE_SELECTOR, 3, 'page_size')]
+
+# O frame de trabalho é o primeiro que tem o título da carteira ou o formulário
+FRAME_HAS_CONTENT_JS = "() => !!document.querySelector('h2, form')"
+
+# Seletores onde o título "Carteira do Dia - dd/mm/yy" pode estar, em ordem
+DATE_SELECTORS = [
+    'h2:has-text("Carteira")',
+    'h2',
+    'form h2',
+    '#divContainerIframeB3 form h2',
+    '.title',
+    '[class*="title"]',
+    '[class*="header"]',
+]
+
+# Primeiro elemento visível com o título, testando os seletores em ordem
+# (uma única ida ao browser). Seletores do Playwright (:has-text) não existem
+# no DOM e são ignorados aqui. Retorna [seletor, texto] ou null.
+DATE_JS = """
+selectors => {
+    for (const selector of selectors) {
+        let elements;
+        try { elements = document.querySelectorAll(selector); } catch (e) { continue; }
+        for (const el of elements) {
+            if (!el.getClientRects().length) continue;
+            const text = (el.textContent || '').trim();
+            if (text.includes('Carteira') && text.includes('-')) return [selector, text];
+        }
+    }
+    return null;
+}
+"""
+
+# Estratégia de descoberta aprendida (frame, seletor da data, tabela), em
+# /tmp e, opcionalmente, no bucket (B3_STRATEGY_S3_KEY, ex.: cache/page_strategy.json)
+PAGE_STRATEGY_CACHE = '/tmp/b3_page_strategy.json'
+PAGE_STRATEGY_S3_KEY = os.environ.get('B3_STRATEGY_S3_KEY')
+
+# Frame direto: abre o src do iframe da carteira como página principal, sem
+# carregar o portal externo. B3_FRAME_URL fixa a URL (com '{index}' no lugar
+# do índice para valer em lotes); sem ela, o src é descoberto na primeira
+# execução e guardado na estratégia
+DIRECT_FRAME = os.environ.get('B3_DIRECT_FRAME', '1') != '0'
+FRAME_URL = os.environ.get('B3_FRAME_URL')
+
+def load_page_strategy():
+    """
+    Lê a estratégia aprendida em uma execução anterior ({} se não houver)
+    """
+    try:
+        with open(PAGE_STRATEGY_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    if PAGE_STRATEGY_S3_KEY:
+        try:
+            return json.loads(storage_get(PAGE_STRATEGY_S3_KEY))
+        except Exception as e:
+            print(f"Estratégia não encontrada em {PAGE_STRATEGY_S3_KEY}: {type(e).__name__}")
+    return {}
+
+def store_page_strategy(strategy):
+    """
+    Grava a estratégia em /tmp e, se configurado, no bucket
+    """
+    try:
+        with open(PAGE_STRATEGY_CACHE, 'w') as f:
+            json.dump(strategy, f)
+    except OSError as e:
+        print(f"Não foi possível salvar a estratégia: {e}")
+    if PAGE_STRATEGY_S3_KEY:
+        try:
+            storage_put(PAGE_STRATEGY_S3_KEY, io.BytesIO(json.dumps(strategy).encode('utf-8')))
+        except Exception as e:
+            print(f"Não foi possível salvar a estratégia em {PAGE_STRATEGY_S3_KEY}: {e}")
+
+def update_page_strategy(strategy, antes):
+    """
+    Grava a estratégia só se a execução aprendeu algo diferente de `antes`
+    """
+    if strategy == antes:
+        return False
+    print(f"Estratégia de descoberta atualizada: {strategy}")
+    store_page_strategy(strategy)
+    return True
+
+def frame_has_content(frame):
+    try:
+        return bool(frame.evaluate(FRAME_HAS_CONTENT_JS))
+    except Exception as e:
+        print(f"Frame {frame.url} inacessível: {type(e).__name__}")
+        return False
+
+def resolve_working_frame(page, strategy=None):
+    """
+    Frame que contém a carteira: a página principal ou um iframe filho
+    (page.frames é mantido pelo cliente, sem ida ao browser). O frame da
+    estratégia aprendida é testado primeiro.
+    """
+    for frame in frame_candidates(page, strategy):
+        if frame_has_content(frame):
+            return learn_frame(page, frame, strategy)
+    return page.main_frame
+
+async def resolve_working_frame_async(page, strategy=None):
+    """
+    resolve_working_frame para o engine assíncrono
+    """
+    for frame in frame_candidates(page, strategy):
+        try:
+            if await frame.evaluate(FRAME_HAS_CONTENT_JS):
+                return learn_frame(page, frame, strategy)
+        except Exception as e:
+            print(f"Frame {frame.url} inacessível: {type(e).__name__}")
+    return page.main_frame
+
+def frame_candidates(page, strategy=None):
+    """
+    Frames da página na ordem de teste: o da estratégia aprendida primeiro
+    """
+    aprendido = (strategy or {}).get('frame')
+    return sorted(page.frames, key=lambda frame: frame_key(page, frame) != aprendido)
+
+def learn_frame(page, frame, strategy=None):
+    chave = frame_key(page, frame)
+    if strategy is not None:
+        if strategy.get('frame') not in (None, chave):
+            print("Frame da estratégia em cache não validou, usando o encontrado na busca")
+        strategy['frame'] = chave
+    return frame
+
+def frame_key(page, frame):
+    """
+    Identificação estável do frame: 'main' ou nome/caminho da URL do iframe
+    """
+    if frame is page.main_frame:
+        return 'main'
+    return frame.name or urlparse(frame.url).path
+
+def direct_frame_url(strategy, index=None):
+    """
+    URL do documento do iframe para abrir direto. B3_FRAME_URL pode ter
+    '{index}' (vale para qualquer índice); sem ele, vale só para o índice
+    padrão, assim como a URL aprendida só vale para o índice em que foi
+    descoberta
+    """
+    if not DIRECT_FRAME:
+        return None
+    index = index or DEFAULT_INDEX
+    if FRAME_URL and '{index}' in FRAME_URL:
+        return FRAME_URL.replace('{index}', index)
+    if FRAME_URL and index == DEFAULT_INDEX:
+        return FRAME_URL
+    if strategy.get('frame_index', DEFAULT_INDEX) != index:
+        return None
+    return strategy.get('frame_src')
+
+def learn_frame_src(page, frame, strategy, index=None):
+    """
+    Se a carteira está em um iframe (e o modo frame direto está ligado),
+    guarda o src na estratégia e devolve a URL para abrir como página
+    """
+    if not DIRECT_FRAME or frame is page.main_frame \
+            or not domain_allowed(urlparse(frame.url).hostname):
+        return None
+    if strategy is not None:
+        strategy.update(frame_src=frame.url, frame_index=index or DEFAULT_INDEX, frame='main')
+    return frame.url
+
+def extract_date(frame, strategy=None):
+    """
+    Data (dd-mm-yy) do título da carteira, tentando primeiro o seletor aprendido
+    """
+    for seletores in date_selector_attempts(strategy):
+        encontrado = frame.evaluate(DATE_JS, seletores)
+        if encontrado:
+            return learn_date(encontrado, strategy)
+    return None
+
+async def extract_date_async(frame, strategy=None):
+    """
+    extract_date para o engine assíncrono
+    """
+    for seletores in date_selector_attempts(strategy):
+        encontrado = await frame.evaluate(DATE_JS, seletores)
+        if encontrado:
+            return learn_date(encontrado, strategy)
+    return None
+
+def date_selector_attempts(strategy=None):
+    """
+    Listas de seletores a testar em ordem: o aprendido sozinho, depois todos
+    """
+    aprendido = (strategy or {}).get('date_selector')
+    return [[aprendido], DATE_SELECTORS] if aprendido else [DATE_SELECTORS]
+
+def learn_date(encontrado, strategy=None):
+    """
+    Guarda o seletor que trouxe o título e devolve a data no formato dd-mm-yy
+    """
+    seletor, texto = encontrado
+    if strategy is not None:
+        if strategy.get('date_selector') not in (None, seletor):
+            print("Seletor de data em cache não validou, usando o encontrado na busca")
+        strategy['date_selector'] = seletor
+    return texto.split("-")[-1].strip().replace("/", "-")
+
+def debug_page_structure(page):
+    """
+    Sondas de diagnóstico (B3_DEBUG=1): iframes, elementos principais e selects
+    da página. Cada uma custa idas ao browser; fora do modo debug não rodam.
+    """
+    with span('debug_probes'):
+        print("=== DEBUG: Verificando estrutura da página ===")
+        iframes = page.locator('iframe')
+        for i in range(iframes.count()):
+            iframe = iframes.nth(i)
+            print(f"Iframe {i}: src={iframe.get_attribute('src')}, id={iframe.get_attribute('id')}")
+        
+        for element in ['#divContainerIframeB3', '#segment', '#selectPage', 'h2', 'form']:
+            print(f"Elemento '{element}': {page.locator(element).count()} encontrado(s)")
+        
+        selects = page.locator('select')
+        for i in range(selects.count()):
+            select_element = selects.nth(i)
+            print(f"Select {i}: id={select_element.get_attribute('id')}, name={select_element.get_attribute('name')}")
+        
+        for frame in page.frames:
+            print(f"Frame: url={frame.url}, nome={frame.name}")
+
+def scrape_b3_data(mode=None, index=None, raise_errors=False):
     """
     Extrai dados da B3 usando Playwright - equivalente à função obtemDadosB3
+
+    mode: 'auto' (HTTP direto, captura do JSON e DOM, nessa ordem),
+    'http', 'capture' ou 'dom'
+    index: índice da carteira (padrão DEFAULT_INDEX)
+    raise_errors: propaga falhas do browser em vez de devolver dados vazios
     """
-    url = "https://sistemaswebb3-listados.b3.com.br/indexPage/day/IBOV?language=pt-br"
+    mode = mode or os.environ.get('B3_SCRAPE_MODE', 'auto')
+    url = index_url(index or DEFAULT_INDEX)
     data_formatada = None
     
+    if mode in ('auto', 'http'):
+        resultado = scrape_b3_http(index)
+        if resultado:
+            return resultado
+        print("Modo HTTP sem resultado, usando o browser")
+    
     try:
-        with sync_playwright() as p:
-            print("Iniciando browser...")
-            
-            # Paths possíveis para o Chromium em diferentes ambientes
-            possible_paths = [
-                '/var/task/browsers/chromium-*/chrome-linux/chrome',
-                '/var/task/.playwright/chromium-*/chrome-linux/chrome',
-                '/root/.cache/ms-playwright/chromium-*/chrome-linux/chrome',
-                '/home/pwuser/.cache/ms-playwright/chromium-*/chrome-linux/chrome'
-            ]
-            
-            chrome_executable = None
-            for pattern in possible_paths:
-                matches = glob.glob(pattern)
-                if matches:
-                    chrome_executable = matches[0]
-                    print(f"Encontrado Chromium em: {chrome_executable}")
-                    break
-            
-            # Criar diretório temporário único para user data
-            temp_dir = tempfile.mkdtemp(prefix="playwright_", dir="/tmp")
-            
-            # Configuração otimizada para Lambda
-            launch_options = {
-                'headless': True,
-                'args': [
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-gpu',
-                    '--disable-web-security',
-                    '--disable-extensions',
-                    '--disable-plugins',
-                    '--disable-images',
-                    '--disable-default-apps',
-                    '--disable-background-timer-throttling',
-                    '--disable-backgrounding-occluded-windows',
-                    '--disable-renderer-backgrounding',
-                    '--disable-field-trial-config',
-                    '--disable-back-forward-cache',
-                    '--disable-ipc-flooding-protection',
-                    '--disable-hang-monitor',
-                    '--disable-prompt-on-repost',
-                    '--disable-sync',
-                    '--disable-translate',
-                    '--disable-features=TranslateUI,VizDisplayCompositor,AudioServiceOutOfProcess',
-                    '--hide-scrollbars',
-                    '--mute-audio',
-                    '--no-first-run',
-                    '--no-default-browser-check',
-                    '--no-zygote',
-                    '--single-process',
-                    '--disable-breakpad',
-                    '--disable-component-extensions-with-background-pages',
-                    '--disable-component-update',
-                    '--disable-client-side-phishing-detection',
-                    '--memory-pressure-off',
-                    '--max_old_space_size=4096',
-                    '--enable-logging',
-                    '--log-level=0',
-                    '--data-path=/tmp',
-                    '--disk-cache-dir=/tmp',
-                    '--homedir=/tmp',
-                    '--remote-debugging-port=9222',
-                    '--disable-background-networking',
-                    '--disable-popup-blocking',
-                    '--disable-web-resources',
-                    '--enable-automation',
-                    '--force-color-profile=srgb',
-                    '--metrics-recording-only',
-                    '--no-service-autorun',
-                    '--password-store=basic',
-                    '--use-mock-keychain',
-                    '--export-tagged-pdf'
-                ]
-            }
-            
-            # Se encontrou o executável, usar o caminho específico
-            if chrome_executable:
-                launch_options['executable_path'] = chrome_executable
-                print(f"Usando executável: {chrome_executable}")
-            else:
-                print("Usando Chromium padrão do sistema")
+        print("Iniciando browser...")
+        # Os contadores são zerados uma vez por invocação (lambda_handler): em
+        # um lote, os índices somam no mesmo total
+        if not _network_stats:
+            reset_network_stats()
+        
+        try:
+            with span('browser_launch') as s:
+                context = acquire_browser_context()
+                s.set(start=(_browser['last_start'] or {}).get('start'))
             
-            # Definir variáveis de ambiente específicas para o Chrome
-            os.environ['CHROME_DEVEL_SANDBOX'] = '/usr/local/sbin/chrome-devel-sandbox'
-            os.environ['DISPLAY'] = ':99'
+            # Configurar page com timeouts apropriados
+            page = context.new_page()
+            page.set_default_timeout(30000)  # 30 segundos
+            page.set_default_navigation_timeout(30000)
             
-            try:
-                print("Lançando browser com contexto persistente...")
-                context = p.chromium.launch_persistent_context(
-                    user_data_dir=temp_dir,
-                    headless=True,
-                    args=launch_options['args'],
-                    executable_path=launch_options.get('executable_path')
-                )
-                
-                print("Browser/contexto iniciado com sucesso!")
-                
-                # Configurar page com timeouts apropriados
-                page = context.new_page()
-                page.set_default_timeout(30000)  # 30 segundos
-                page.set_default_navigation_timeout(30000)
-                
-                print(f"Acessando: {url}")
-                
-                # Aguardar carregamento completo
-                page.goto(url, wait_until='networkidle')
-                page.wait_for_timeout(5000)  # Aguardar mais tempo
-                
-                print("Página carregada.")
-                
-                # DEBUG: Verificar estrutura da página
-                print("=== DEBUG: Verificando estrutura da página ===")
-                
-                # Verificar se há iframes
-                iframe_count = page.locator('iframe').count()
-                print(f"Número de iframes encontrados: {iframe_count}")
-                
-                if iframe_count > 0:
-                    for i in range(iframe_count):
-                        iframe = page.locator('iframe').nth(i)
-                        src = iframe.get_attribute('src')
-                        id_attr = iframe.get_attribute('id')
-                        print(f"Iframe {i}: src={src}, id={id_attr}")
-                
-                # Verificar elementos principais
-                main_elements = ['#divContainerIframeB3', '#segment', '#selectPage', 'h2', 'form']
-                for element in main_elements:
-                    count = page.locator(element).count()
-                    print(f"Elemento '{element}': {count} encontrado(s)")
-                
-                # Tentar encontrar o iframe correto
-                working_page = page
-                if iframe_count > 0:
-                    try:
-                        # Tentar o iframe principal (geralmente o primeiro)
-                        main_iframe = page.frame_locator('iframe').first
-                        print("Tentando usar iframe principal...")
-                        
-                        # Testar se consegue acessar elementos dentro do iframe
-                        test_h2 = main_iframe.locator('h2').count()
-                        test_form = main_iframe.locator('form').count()
-                        print(f"No iframe - h2: {test_h2}, form: {test_form}")
-                        
-                        if test_h2 > 0 or test_form > 0:
-                            print("Usando iframe para extrair dados")
-                            # Usar o iframe como contexto
-                            working_context = main_iframe
-                        else:
-                            print("Iframe não contém os elementos esperados, usando página principal")
-                            working_context = page
-                    except Exception as e:
-                        print(f"Erro ao acessar iframe: {e}")
-                        working_context = page
-                else:
-                    working_context = page
+            capturas = []
+            if mode != 'dom':
+                attach_portfolio_capture(page, capturas)
+            
+            # Estratégia aprendida: só é regravada se alguma parte for refeita
+            strategy = load_page_strategy()
+            strategy_antes = dict(strategy)
+            
+            def json_capturado(timeout_ms):
+                if not capturas:
+                    raise LookupError("nenhuma resposta da carteira")
+            
+            def navegar(destino):
+                print(f"Acessando: {destino}")
+                with span('navigation', url=destino, direct=destino != url):
+                    page.goto(destino, wait_until='networkidle')
+                    wait_ready('load', [
+                        ('portfolio_json', json_capturado),
+                        ('page_content', wait_page_ready(page)),
+                    ])
+            
+            # Modo frame direto: o documento do iframe é aberto como página principal
+            frame_url = direct_frame_url(strategy, index)
+            navegar(frame_url or url)
+            if frame_url and not capturas and not frame_has_content(page.main_frame):
+                print("Documento do iframe sem conteúdo, voltando para a página externa")
+                strategy.pop('frame_src', None)
+                frame_url = None
+                navegar(url)
+            
+            print("Página carregada.")
+            
+            # Se o JSON da carteira foi capturado, não é preciso percorrer o DOM
+            if capturas:
+                resultado = read_portfolio_capture(capturas)
+                if resultado:
+                    dados, data_capturada, resumo = resultado
+                    release_page(page)
+                    dados = dedupe_rows(fit_rows(dados))
+                    record_completeness(dados, resumo)
+                    return dados, COLUNAS, data_capturada or datetime.now().strftime("%d-%m-%y")
+                print("JSON capturado sem dados, usando o DOM")
+            
+            if DEBUG_MODE:
+                debug_page_structure(page)
+            
+            with span('frame_resolution', cached='frame' in strategy) as s:
+                working_frame = resolve_working_frame(page, strategy)
+                s.set(frame=frame_key(page, working_frame))
+            
+            # Dados dentro de um iframe: guarda o src e passa a trabalhar no
+            # documento dele, para que selects e tabelas sejam lidos sem
+            # atravessar frames (e as próximas execuções já abram direto nele)
+            frame_url = learn_frame_src(page, working_frame, strategy, index)
+            if frame_url:
+                navegar(frame_url)
+                working_frame = page.main_frame
 
-                # Extrair data com diferentes estratégias
+            # Data do título "Carteira do Dia - dd/mm/yy" (uma chamada ao browser)
+            with span('date_extraction', cached='date_selector' in strategy) as s:
                 data_formatada = datetime.now().strftime("%d-%m-%y")  # Valor padrão
-                
                 try:
-                    print("Tentando extrair data...")
-                    
-                    # Diferentes seletores para tentar encontrar a data
-                    date_selectors = [
-                        'h2:has-text("Carteira")',
-                        'h2',
-                        'form h2',
-                        '#divContainerIframeB3 form h2',
-                        '.title',
-                        '[class*="title"]',
-                        '[class*="header"]'
-                    ]
-                    
-                    date_found = False
-                    for selector in date_selectors:
-                        try:
-                            if hasattr(working_context, 'locator'):
-                                elements = working_context.locator(selector)
-                            else:
-                                elements = working_context.locator(selector)
-                            
-                            count = elements.count()
-                            print(f"Seletor '{selector}': {count} elemento(s)")
-                            
-                            if count > 0:
-                                for i in range(count):
-                                    element = elements.nth(i)
-                                    if element.is_visible():
-                                        text = element.text_content().strip()
-                                        print(f"Texto encontrado: '{text}'")
-                                        
-                                        if "Carteira" in text and "-" in text:
-                                            data_parte = text.split("-")[-1].strip()
-                                            data_formatada = data_parte.replace("/", "-")
-                                            print(f"Data extraída: {data_formatada}")
-                                            date_found = True
-                                            break
-                                
-                                if date_found:
-                                    break
-                        except Exception as e:
-                            print(f"Erro com seletor de data '{selector}': {e}")
-                            continue
-                    
-                    if not date_found:
+                    data_extraida = extract_date(working_frame, strategy)
+                    if data_extraida:
+                        data_formatada = data_extraida
+                        print(f"Data extraída: {data_formatada}")
+                    else:
                         print("Data não encontrada, usando data atual")
-                        
+                    s.set(found=bool(data_extraida))
                 except Exception as e:
                     print(f"Erro ao extrair data: {e}")
+                    s.set(found=False)
 
-                # Tentar interagir com os elementos de seleção
-                print("=== Tentando interagir com elementos ===")
-                
-                # Aguardar mais tempo para carregar
-                page.wait_for_timeout(5000)
-                
-                # Tentar diferentes estratégias para encontrar e interagir com os elementos
-                try:
-                    # Procurar por elementos select em toda a página
-                    all_selects = page.locator('select').count()
-                    print(f"Total de elementos select na página: {all_selects}")
-                    
-                    if all_selects > 0:
-                        for i in range(all_selects):
-                            select_element = page.locator('select').nth(i)
-                            select_id = select_element.get_attribute('id')
-                            select_name = select_element.get_attribute('name')
-                            print(f"Select {i}: id={select_id}, name={select_name}")
-                            
-                            # Se encontrar o select do segmento
-                            if select_id == 'segment' or 'segment' in str(select_name):
-                                print("Encontrado select de segmento, tentando selecionar...")
-                                try:
-                                    select_element.select_option(index=1)
-                                    page.wait_for_timeout(2000)
-                                    print("Segmento selecionado com sucesso")
-                                except Exception as e:
-                                    print(f"Erro ao selecionar segmento: {e}")
-                            
-                            # Se encontrar o select da página
-                            elif select_id == 'selectPage' or 'page' in str(select_name):
-                                print("Encontrado select de página, tentando selecionar...")
-                                try:
-                                    select_element.select_option(index=3)
-                                    page.wait_for_timeout(3000)
-                                    print("Página selecionada com sucesso")
-                                except Exception as e:
-                                    print(f"Erro ao selecionar página: {e}")
-                
-                except Exception as e:
-                    print(f"Erro ao interagir com selects: {e}")
-                
-                # Aguardar carregamento final
-                print("Aguardando carregamento final da tabela...")
-                page.wait_for_timeout(5000)
-                
-                # Tentar extrair dados da tabela com diferentes estratégias
-                print("=== Extraindo dados da tabela ===")
-                
-                # Verificar todas as tabelas na página
-                table_count = page.locator('table').count()
-                print(f"Total de tabelas encontradas: {table_count}")
-                
-                dados = []
-                
-                if table_count > 0:
-                    for table_idx in range(table_count):
-                        print(f"Analisando tabela {table_idx}")
-                        table = page.locator('table').nth(table_idx)
-                        
-                        # Verificar linhas na tabela
-                        row_selectors = ['tbody tr', 'tr']
-                        
-                        for row_selector in row_selectors:
-                            try:
-                                rows = table.locator(row_selector)
-                                row_count = rows.count()
-                                print(f"Tabela {table_idx} - '{row_selector}': {row_count} linhas")
-                                
-                                if row_count > 0:
-                                    for i in range(min(row_count, 100)):  # Limitar a 100 linhas para teste
-                                        try:
-                                            row = rows.nth(i)
-                                            cells = row.locator('td')
-                                            cell_count = cells.count()
-                                            
-                                            if cell_count > 0:
-                                                row_data = []
-                                                for j in range(cell_count):
-                                                    cell = cells.nth(j)
-                                                    cell_text = cell.text_content().strip()
-                                                    row_data.append(cell_text)
-                                                
-                                                if any(cell.strip() for cell in row_data):
-                                                    dados.append(row_data)
-                                                    
-                                                    # Log das primeiras linhas para debug
-                                                    if len(dados) <= 3:
-                                                        print(f"Linha {len(dados)}: {row_data}")
-                                        
-                                        except Exception as e:
-                                            print(f"Erro ao processar linha {i}: {e}")
-                                            continue
-                                    
-                                    if dados:
-                                        print(f"Dados extraídos da tabela {table_idx}: {len(dados)} linhas")
-                                        break
-                                        
-                            except Exception as e:
-                                print(f"Erro com seletor '{row_selector}' na tabela {table_idx}: {e}")
-                                continue
-                        
-                        if dados:
-                            break
-                
-                context.close()
-                
-                # Limpar diretório temporário
-                try:
-                    shutil.rmtree(temp_dir)
-                except:
-                    pass
+            # Selecionar segmento e tamanho de página, esperando a tabela recarregar
+            with span('interaction'):
+                wait_ready('interaction', [
+                    ('select_attached', lambda t: page.wait_for_selector('select', state='attached', timeout=t)),
+                ])
+                for seletor, option_index, fase in INTERACTION_SELECTS:
+                    select_element = page.locator(seletor).first
+                    try:
+                        if select_element.count():
+                            select_and_wait(page, select_element, option_index, fase)
+                        else:
+                            print(f"Select de {fase} não encontrado")
+                    except Exception as e:
+                        print(f"Erro ao selecionar {fase}: {e}")
+            
+            # Extração em lote: uma única chamada ao browser para todas as tabelas
+            with span('table_extraction', cached='table' in strategy) as s:
+                wait_ready('table', [('table_rows_stable', wait_rows_stable(page))])
+                dados, resumo = collect_dom_pages(page, strategy)
+                s.set(rows=len(dados))
+            
+            update_page_strategy(strategy, strategy_antes)
+            print(f"Rede: {_network_stats}")
+            print(f"Dados extraídos: {len(dados)} linhas")
+            
+            release_page(page)
 
-                colunas = ["Setor", "Código", "Ação", "Tipo", "Qtde. Teórica", "Part. (%)", "Part. (%)Acum."]
-                
-                print(f"=== RESULTADO FINAL ===")
-                print(f"Total de registros extraídos: {len(dados)}")
-                print(f"Data formatada: {data_formatada}")
+            colunas = COLUNAS
+            
+            print(f"=== RESULTADO FINAL ===")
+            print(f"Total de registros extraídos: {len(dados)}")
+            print(f"Data formatada: {data_formatada}")
+            
+            if dados:
+                # Ajustar dados se necessário
+                dados_ajustados = dedupe_rows(fit_rows(dados, colunas))
+                record_completeness(dados_ajustados, resumo)
                 
-                if dados:
-                    # Ajustar dados se necessário
-                    dados_ajustados = []
-                    for linha in dados:
-                        if len(linha) >= len(colunas):
-                            dados_ajustados.append(linha[:len(colunas)])
-                        elif len(linha) > 0:
-                            linha_ajustada = linha + [''] * (len(colunas) - len(linha))
-                            dados_ajustados.append(linha_ajustada)
-                    
-                    print(f"Dados ajustados: {len(dados_ajustados)} linhas")
-                    return dados_ajustados, colunas, data_formatada
-                else:
-                    print("Nenhum dado extraído")
-                    return [], colunas, data_formatada
-                    
-            except Exception as browser_error:
-                print(f"Erro específico do browser: {browser_error}")
-                import traceback
-                traceback.print_exc()
-                raise browser_error
+                print(f"Dados ajustados: {len(dados_ajustados)} linhas")
+                return dados_ajustados, colunas, data_formatada
+            else:
+                print("Nenhum dado extraído")
+                return [], colunas, data_formatada
                 
+        except Exception as browser_error:
+            print(f"Erro específico do browser: {browser_error}")
+            # Descartar o browser: a próxima invocação relança do zero
+            shutdown_browser()
+            import traceback
+            traceback.print_exc()
+            raise browser_error
+            
     except Exception as e:
         print(f"Erro geral: {e}")
         import traceback
         traceback.print_exc()
-        colunas = ["Setor", "Código", "Ação", "Tipo", "Qtde. Teórica", "Part. (%)", "Part. (%)Acum."]
+        if raise_errors:
+            raise
+        colunas = COLUNAS
         if data_formatada is None:
             data_formatada = datetime.now().strftime("%d-%m-%y")
         return [], colunas, data_formatada
 
-def save_to_parquet(dados, colunas, filename, data_formatada):
+async def scrape_index_dom_async(page, index, strategy=None):
     """
-    Salva os dados em formato parquet no S3
+    Extração pelo DOM de uma página assíncrona já carregada: os mesmos passos
+    de scrape_b3_data (frame, data, selects, tabela paginada), com os helpers
+    compartilhados e a mesma estratégia aprendida
     """
+    await wait_ready_async('load', [('page_content', wait_page_ready_async(page))])
+    
+    working_frame = await resolve_working_frame_async(page, strategy)
+    frame_url = learn_frame_src(page, working_frame, strategy, index)
+    if frame_url:
+        await page.goto(frame_url, wait_until='networkidle')
+        await wait_ready_async('load', [('page_content', wait_page_ready_async(page))])
+        working_frame = page.main_frame
+    data_formatada = await extract_date_async(working_frame, strategy)
+    if not data_formatada:
+        print(f"[{index}] data não encontrada")
+    
+    await wait_ready_async('interaction', [
+        ('select_attached', lambda t: page.wait_for_selector('select', state='attached', timeout=t)),
+    ])
+    for seletor, option_index, fase in INTERACTION_SELECTS:
+        select_element = page.locator(seletor).first
+        try:
+            if await select_element.count():
+                await select_and_wait_async(page, select_element, option_index, fase)
+            else:
+                print(f"[{index}] select de {fase} não encontrado")
+        except Exception as e:
+            print(f"[{index}] erro ao selecionar {fase}: {e}")
+    
+    await wait_ready_async('table', [('table_rows_stable', wait_rows_stable_async(page))])
+    dados, resumo = await collect_dom_pages_async(page, strategy)
+    return dados, data_formatada, resumo
+
+async def scrape_index_async(get_context, index, mode, strategy=None, captured_request=None):
+    """
+    Extrai a carteira de um índice: HTTP direto, captura do JSON e DOM.
+    captured_request (dict) recebe url e headers da chamada capturada, para
+    o lote guardá-la uma vez (store_portfolio_request) no final.
+    Retorna (dados, data_formatada, resumo).
+    """
+    if mode in ('auto', 'http'):
+        resultado = await asyncio.to_thread(fetch_index_http, index)
+        if resultado:
+            return resultado
+        if mode == 'http':
+            print(f"[{index}] modo HTTP sem resultado, usando o browser")
+    
+    context = await get_context()
+    page = await context.new_page()
+    page.set_default_timeout(30000)
+    capturas = []
+    if mode != 'dom':
+        page.on('response', lambda r: capturas.append(r) if PORTFOLIO_API_PATH in r.url and r.ok else None)
+    
     try:
-        # Criar DataFrame
-        df = pd.DataFrame(dados, columns=colunas)
-        
-        # Adicionar timestamp
-        df['Dia'] = data_formatada
+        # Modo frame direto, como em scrape_b3_data
+        frame_url = direct_frame_url(strategy or {}, index)
+        await page.goto(frame_url or index_url(index), wait_until='networkidle')
+        if frame_url and not capturas and not await page.evaluate(FRAME_HAS_CONTENT_JS):
+            print(f"[{index}] documento do iframe sem conteúdo, voltando para a página externa")
+            if strategy is not None:
+                strategy.pop('frame_src', None)
+            await page.goto(index_url(index), wait_until='networkidle')
         
-        print(f"Shape do DataFrame: {df.shape}")
-        print(f"Primeiras 3 linhas:")
-        print(df.head(3))
-        
-        # Salvar em buffer de memória
-        buffer = io.BytesIO()
-        df.to_parquet(buffer, engine='pyarrow')
-        buffer.seek(0)
+        for response in reversed(capturas):
+            try:
+                payload = await response.json()
+                dados, data_formatada, info = parse_portfolio_payload(payload)
+            except Exception as e:
+                print(f"[{index}] erro ao ler JSON capturado: {e}")
+                continue
+            if not dados:
+                continue
+            if captured_request is not None:
+                captured_request.update(url=response.url, headers=response.request.headers)
+            resumo = portfolio_summary(payload)
+            print(f"[{index}] JSON da carteira capturado: {len(dados)} registros")
+            if int(info.get('totalPages') or 1) > 1:
+                headers = replay_headers(response.request.headers)
+                try:
+                    dados, data_http, resumo = await asyncio.to_thread(fetch_portfolio_http, response.url, headers)
+                except Exception as e:
+                    print(f"[{index}] erro ao completar páginas via HTTP: {e}")
+                    continue
+                data_formatada = data_formatada or data_http
+            return dados, data_formatada, resumo
         
-        # Configurar S3
-        s3_client = boto3.client('s3')
-        bucket_name = os.environ.get('S3_BUCKET_NAME')
-        s3_key = f"data/{filename}"
+        return await scrape_index_dom_async(page, index, strategy)
+    finally:
+        await page.close()
+
+async def scrape_indices_async(indices, mode=None, max_concurrency=None, on_result=None):
+    """
+    Extrai vários índices em paralelo com um único browser, limitando a
+    concorrência. O browser só é lançado se algum índice precisar dele.
+    on_result(index, dados, data_formatada) roda em thread para cada índice
+    extraído (ex.: gravar o parquet) sem bloquear os demais.
+    """
+    mode = mode or os.environ.get('B3_SCRAPE_MODE', 'auto')
+    semaphore = asyncio.Semaphore(max_concurrency or MAX_CONCURRENCY)
+    estado = {'browser': None, 'context': None}
+    lock = asyncio.Lock()
+    stats = new_network_stats()
+    # Estratégia de descoberta compartilhada pelos índices do lote
+    strategy = load_page_strategy()
+    strategy_antes = dict(strategy)
+    # Última chamada da carteira capturada no lote (semeia o modo HTTP e a sonda)
+    captured_request = {}
+    
+    async with lazy_import('playwright.async_api').async_playwright() as p:
+        async def get_context():
+            async with lock:
+                if estado['context'] is None:
+                    print("Lançando browser assíncrono...")
+                    args = [a for a in launch_args() if not a.startswith('--remote-debugging-port')]
+                    estado['browser'] = await p.chromium.launch(
+                        headless=True, args=args, executable_path=find_chrome_executable())
+                    estado['context'] = await estado['browser'].new_context()
+                    if REQUEST_BLOCKING:
+                        await install_request_filter_async(estado['context'], stats)
+            return estado['context']
         
-        if not bucket_name:
-            raise ValueError("Variável de ambiente S3_BUCKET_NAME não definida")
+        async def run(index):
+            async with semaphore:
+                inicio = time.perf_counter()
+                resultado = {'index': index}
+                try:
+                    with span('index_scrape', index=index) as s:
+                        dados, data_formatada, resumo = await scrape_index_async(
+                            get_context, index, mode, strategy, captured_request)
+                        s.set(rows=len(dados))
+                    dados = dedupe_rows(fit_rows(dados))
+                    data_formatada = data_formatada or datetime.now().strftime("%d-%m-%y")
+                    resultado.update(status='ok' if dados else 'empty', registros=len(dados),
+                                     data_formatada=data_formatada,
+                                     completeness=check_completeness(dados, resumo))
+                except Exception as e:
+                    print(f"[{index}] erro: {e}")
+                    resultado.update(status='error', error=str(e))
+                    dados = None
+            
+            # Gravação fora do semáforo: não segura vaga de página do browser
+            if dados and on_result:
+                try:
+                    resultado['s3_path'] = await asyncio.to_thread(on_result, index, dados, data_formatada)
+                    if resultado['s3_path'] is None:
+                        resultado['status'] = 'error'
+                except Exception as e:
+                    resultado.update(status='error', error=str(e))
+            resultado['seconds'] = round(time.perf_counter() - inicio, 3)
+            print(f"[{index}] {resultado}")
+            return resultado
         
-        # Upload para S3
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=buffer.getvalue(),
-            ContentType='application/octet-stream'
+        try:
+            resultados = await asyncio.gather(*(run(index) for index in indices))
+        finally:
+            if estado['browser'] is not None:
+                await estado['browser'].close()
+    
+    update_page_strategy(strategy, strategy_antes)
+    if captured_request:
+        store_portfolio_request(captured_request['url'], captured_request['headers'])
+    
+    return list(resultados), (stats if estado['context'] is not None else None)
+
+def scrape_and_save_indices(indices, mode=None, force=False):
+    """
+    Extrai e grava um parquet por índice (ver dataset_filename).
+    Índices cuja carteira do dia já está no S3 são pulados.
+    """
+    def nome_arquivo(index):
+        return lambda data: dataset_filename(data, index)
+    
+    diffs = {}
+    
+    def salvar(index, dados, data_formatada):
+        filename = nome_arquivo(index)(data_formatada)
+        with span('normalization', index=index, rows=len(dados)):
+            table = build_arrow_table(dados, COLUNAS, data_formatada)
+        s3_path = save_to_parquet(dados, COLUNAS, filename, data_formatada, table=table)
+        if s3_path:
+            diffs[index] = diff_with_previous(table, filename, data_formatada, index)
+        return s3_path
+    
+    # Criar o cliente S3 antes das threads de gravação
+    get_s3_client()
+    
+    pulados = []
+    if not force:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+            ingeridos = list(pool.map(lambda index: already_ingested(nome_arquivo(index), index), indices))
+        pulados = [
+            {'index': index, 'status': 'skipped', 'data_formatada': data}
+            for index, data in zip(indices, ingeridos) if data
+        ]
+        indices = [index for index, data in zip(indices, ingeridos) if not data]
+    
+    if not indices:
+        return pulados, None
+    # O engine assíncrono roda em uma thread própria, com seu próprio event
+    # loop: se o browser síncrono de uma invocação anterior ainda estiver vivo
+    # (reuso no container), o loop desta thread consta como em execução e
+    # asyncio.run() falharia aqui
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        resultados, network = pool.submit(
+            asyncio.run, scrape_indices_async(indices, mode, on_result=salvar)).result()
+    for resultado in resultados:
+        if resultado['index'] in diffs:
+            resultado['diff'] = diffs[resultado['index']]
+    return pulados + resultados, network
+
+def scrape_and_save_pipelined(indices, mode=None, force=False):
+    """
+    Lote em pipeline: o browser (contexto persistente) extrai os índices em
+    sequência e cada resultado entra em uma fila limitada (BATCH_QUEUE_SIZE);
+    BATCH_UPLOAD_WORKERS threads montam a tabela, serializam e enviam ao S3
+    com o cliente compartilhado enquanto o browser segue para o próximo.
+    Com a fila cheia a extração espera (backpressure).
+    Retorna (resultados por índice, resumo).
+    """
+    fila = queue.Queue(maxsize=max(1, BATCH_QUEUE_SIZE))
+    workers = max(1, BATCH_UPLOAD_WORKERS)
+    resultados = []
+    resumo = {'queue_size': fila.maxsize, 'workers': workers,
+              'backpressure_seconds': 0.0, 'max_queue_depth': 0}
+    inicio = time.perf_counter()
+    
+    # Criar o cliente S3 antes das threads de gravação
+    get_s3_client()
+    
+    def gravar():
+        while True:
+            item = fila.get()
+            if item is None:
+                return
+            index, dados, data_formatada, resultado = item
+            inicio_gravacao = time.perf_counter()
+            try:
+                with span('normalization', index=index, rows=len(dados)):
+                    table = build_arrow_table(dados, COLUNAS, data_formatada)
+                filename = dataset_filename(data_formatada, index)
+                resultado['s3_path'] = store_dataset_file(dados, COLUNAS, filename, data_formatada, table)
+                resultado['upload'] = _uploads.get(f"{DATASET_PREFIX}{filename}")
+                resultado['diff'] = diff_with_previous(table, filename, data_formatada, index)
+                resultado['status'] = 'ok'
+            except Exception as e:
+                print(f"[{index}] erro ao gravar: {e}")
+                resultado.update(status='error', stage='save', error=str(e))
+            resultado['save_seconds'] = round(time.perf_counter() - inicio_gravacao, 3)
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(gravar)
+        try:
+            for index in indices:
+                resultado = {'index': index}
+                resultados.append(resultado)
+                try:
+                    data_ingerida = None if force else already_ingested(
+                        lambda data, index=index: dataset_filename(data, index), index)
+                    if data_ingerida:
+                        resultado.update(status='skipped', data_formatada=data_ingerida)
+                        continue
+                    
+                    inicio_scrape = time.perf_counter()
+                    _completeness.clear()
+                    dados, _, data_formatada = scrape_b3_data(mode, index, raise_errors=True)
+                    resultado.update(registros=len(dados), data_formatada=data_formatada,
+                                     completeness=dict(_completeness) or None,
+                                     scrape_seconds=round(time.perf_counter() - inicio_scrape, 3))
+                    if not dados:
+                        resultado.update(status='empty')
+                        continue
+                except Exception as e:
+                    print(f"[{index}] erro na extração: {e}")
+                    resultado.update(status='error', stage='scrape', error=str(e))
+                    continue
+                
+                resultado['status'] = 'queued'
+                espera = time.perf_counter()
+                fila.put((index, dados, data_formatada, resultado))
+                resumo['backpressure_seconds'] += time.perf_counter() - espera
+                resumo['max_queue_depth'] = max(resumo['max_queue_depth'], fila.qsize())
+        finally:
+            for _ in range(workers):
+                fila.put(None)
+    
+    contagem = {}
+    for resultado in resultados:
+        contagem[resultado['status']] = contagem.get(resultado['status'], 0) + 1
+    resumo.update(contagem, total=len(resultados),
+                  backpressure_seconds=round(resumo['backpressure_seconds'], 3),
+                  seconds=round(time.perf_counter() - inicio, 3))
+    print(f"Lote em pipeline: {resumo}")
+    return resultados, resumo
+
+def parquet_schema():
+    """
+    Schema Arrow explícito do parquet da carteira
+    """
+    pa = lazy_import('pyarrow')
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        pa.field('Setor', dictionary),
+        pa.field('Código', pa.string()),
+        pa.field('Ação', pa.string()),
+        pa.field('Tipo', dictionary),
+        pa.field('Qtde. Teórica', pa.int64()),
+        pa.field('Part. (%)', pa.float64()),
+        pa.field('Part. (%)Acum.', pa.float64()),
+        pa.field('Dia', pa.date32()),
+    ])
+
+def to_number_array(valores, tipo):
+    """
+    Converte, de forma vetorizada, textos no formato brasileiro
+    ('1.234.567', '12,345') para um array Arrow numérico; inválidos viram nulos
+    """
+    pa = lazy_import('pyarrow')
+    pc = lazy_import('pyarrow.compute')
+    texto = pc.utf8_trim_whitespace(pa.array(valores, type=pa.string()))
+    texto = pc.replace_substring(texto, '.', '')
+    texto = pc.replace_substring(texto, ',', '.')
+    padrao = r'^-?\d+$' if pa.types.is_integer(tipo) else r'^-?\d+(\.\d+)?$'
+    texto = pc.if_else(pc.match_substring_regex(texto, padrao), texto, pa.scalar(None, pa.string()))
+    return pc.cast(texto, tipo)
+
+def build_arrow_table(dados, colunas=COLUNAS, data_formatada=None):
+    """
+    Monta a tabela Arrow tipada direto das linhas extraídas, sem pandas
+    """
+    pa = lazy_import('pyarrow')
+    pc = lazy_import('pyarrow.compute')
+    schema = parquet_schema()
+    valores_por_coluna = list(zip(*dados)) if dados else [() for _ in colunas]
+    
+    arrays = []
+    for nome, valores in zip(colunas, valores_por_coluna):
+        tipo = schema.field(nome).type
+        if nome in INT_COLUMNS or nome in FLOAT_COLUMNS:
+            arrays.append(to_number_array(valores, tipo))
+        elif nome in DICTIONARY_COLUMNS:
+            arrays.append(pc.dictionary_encode(pa.array(valores, type=pa.string())))
+        else:
+            arrays.append(pa.array(valores, type=pa.string()))
+    
+    try:
+        dia = datetime.strptime(data_formatada, "%d-%m-%y").date()
+    except (TypeError, ValueError):
+        dia = None
+    arrays.append(pa.repeat(pa.scalar(dia, pa.date32()), len(dados)))
+    
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_parquet(table, sink, compression=None):
+    """
+    Grava a tabela Arrow em parquet com o codec configurado (snappy, zstd, ...)
+    """
+    pq = lazy_import('pyarrow.parquet')
+    pq.write_table(table, sink, compression=compression or PARQUET_COMPRESSION)
+
+_s3_client = None
+
+def get_s3_client():
+    """
+    Cliente S3 criado uma vez por container (seguro para uso entre threads)
+    """
+    global _s3_client
+    if _s3_client is None:
+        # Conexões suficientes para as threads de gravação em paralelo
+        config = lazy_import('botocore.config').Config(
+            max_pool_connections=max(10, BATCH_UPLOAD_WORKERS, MAX_CONCURRENCY) * 2)
+        _s3_client = lazy_import('boto3').client('s3', config=config)
+    return _s3_client
+
+# Resultado do último envio por chave do S3 ('uploaded' ou 'unchanged')
+_uploads = {}
+
+def rows_hash(dados):
+    """
+    Hash do conteúdo extraído, usado para detectar carteira inalterada
+    """
+    payload = json.dumps(dados, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def dataset_filename(data_formatada, index=None):
+    """
+    Nome do arquivo (relativo a data/) conforme o layout do dataset
+    """
+    if DATASET_LAYOUT == 'partitioned':
+        try:
+            dia = datetime.strptime(data_formatada, "%d-%m-%y")
+            return (f"index={index or DEFAULT_INDEX}/year={dia:%Y}/month={dia:%m}/"
+                    f"b3_data_{data_formatada}.parquet")
+        except (TypeError, ValueError):
+            print(f"Data inválida para partição ({data_formatada}), usando layout flat")
+    # O índice padrão tem um único nome, com ou sem índice explícito
+    if index and index != DEFAULT_INDEX:
+        return f"b3_data_{index}_{data_formatada}.parquet"
+    return f"b3_data_{data_formatada}.parquet"
+
+def partition_prefix(index, year, month):
+    """
+    Prefixo da partição mensal de um índice
+    """
+    return f"{DATASET_PREFIX}index={index}/year={int(year):04d}/month={int(month):02d}/"
+
+def bucket_name():
+    """
+    Bucket configurado em S3_BUCKET_NAME
+    """
+    nome = os.environ.get('S3_BUCKET_NAME')
+    if not nome:
+        raise ValueError("Variável de ambiente S3_BUCKET_NAME não definida")
+    return nome
+
+def storage_configured():
+    """
+    Há onde gravar: diretório local (B3_DATASET_ROOT) ou bucket (S3_BUCKET_NAME)
+    """
+    return bool(DATASET_ROOT or os.environ.get('S3_BUCKET_NAME'))
+
+def storage_uri(key):
+    """
+    Localização do objeto: caminho local (B3_DATASET_ROOT) ou s3://bucket/key
+    """
+    if DATASET_ROOT:
+        return os.path.join(DATASET_ROOT, key)
+    return f"s3://{bucket_name()}/{key}"
+
+def storage_head(key):
+    """
+    Metadados do objeto ou None se não existir (head_object no S3)
+    """
+    if DATASET_ROOT:
+        return {} if os.path.exists(storage_uri(key)) else None
+    if not os.environ.get('S3_BUCKET_NAME'):
+        return None
+    try:
+        response = get_s3_client().head_object(Bucket=bucket_name(), Key=key)
+    except Exception as e:
+        codigo = getattr(e, 'response', {}).get('Error', {}).get('Code')
+        if codigo in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return response.get('Metadata') or {}
+
+def storage_put(key, body, metadata=None):
+    """
+    Grava o objeto a partir de um arquivo em memória (sem copiar o buffer)
+    """
+    if DATASET_ROOT:
+        path = storage_uri(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(body, f)
+        return path
+    get_s3_client().put_object(
+        Bucket=bucket_name(),
+        Key=key,
+        Body=body,
+        ContentType='application/octet-stream',
+        Metadata=metadata or {}
+    )
+    return storage_uri(key)
+
+def storage_list(prefix):
+    """
+    Lista as chaves sob o prefixo
+    """
+    if DATASET_ROOT:
+        base = storage_uri(prefix)
+        if not os.path.isdir(base):
+            return []
+        return [prefix + nome for nome in sorted(os.listdir(base))
+                if os.path.isfile(os.path.join(base, nome))]
+    keys = []
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for pagina in paginator.paginate(Bucket=bucket_name(), Prefix=prefix, Delimiter='/'):
+        keys.extend(obj['Key'] for obj in pagina.get('Contents', []))
+    return keys
+
+def storage_get(key):
+    """
+    Conteúdo do objeto em bytes
+    """
+    if DATASET_ROOT:
+        with open(storage_uri(key), 'rb') as f:
+            return f.read()
+    return get_s3_client().get_object(Bucket=bucket_name(), Key=key)['Body'].read()
+
+def storage_delete(keys):
+    """
+    Remove os objetos (em lotes de 1000 no S3)
+    """
+    if DATASET_ROOT:
+        for key in keys:
+            os.remove(storage_uri(key))
+        return
+    for i in range(0, len(keys), 1000):
+        get_s3_client().delete_objects(
+            Bucket=bucket_name(),
+            Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]]}
         )
+
+def probe_portfolio_date(index=None):
+    """
+    Sonda barata da data da carteira: uma página de 1 registro via HTTP direto
+    (requer uma requisição capturada antes). Retorna dd-mm-yy ou None.
+    """
+    captured = load_portfolio_request()
+    if not captured:
+        return None
+    try:
+        url = build_portfolio_url(captured['url'], 1, page_size=1, index=index or DEFAULT_INDEX)
+        response = get_http_session().get(url, headers=captured.get('headers') or {}, timeout=10)
+        response.raise_for_status()
+        return parse_portfolio_payload(response.json())[1]
+    except Exception as e:
+        print(f"Erro na sonda de data: {e}")
+        return None
+
+def already_ingested(filename_for_date, index=None):
+    """
+    Verifica, sem abrir o browser, se a carteira do dia já está no S3.
+    filename_for_date(data_formatada) devolve o nome do arquivo esperado.
+    Retorna a data se já ingerida, senão None.
+    """
+    if not INGESTION_CHECK:
+        return None
+    with span('ingestion_check', index=index or DEFAULT_INDEX):
+        data_formatada = probe_portfolio_date(index)
+    if not data_formatada:
+        return None
+    s3_key = f"{DATASET_PREFIX}{filename_for_date(data_formatada)}"
+    try:
+        if storage_head(s3_key) is not None:
+            print(f"Carteira de {data_formatada} já ingerida em {s3_key}")
+            return data_formatada
+    except Exception as e:
+        print(f"Erro ao verificar {s3_key}: {e}")
+    return None
+
+def store_dataset_file(dados, colunas, filename, data_formatada, table=None):
+    """
+    Serializa e envia o parquet (table: tabela Arrow já montada); erros sobem.
+    Se o objeto já existe com o mesmo hash de conteúdo, o envio é pulado.
+    """
+    with span('serialization', rows=len(dados)) as s:
+        if table is None:
+            table = build_arrow_table(dados, colunas, data_formatada)
         
-        print(f"Dados salvos no S3: s3://{bucket_name}/{s3_key}")
+        print(f"Shape da tabela: {table.num_rows} x {table.num_columns}")
+        if DEBUG_MODE:
+            print(f"Primeiras 3 linhas: {table.slice(0, 3).to_pylist()}")
+        
+        # Salvar em buffer de memória (colunas tipadas)
+        buffer = io.BytesIO()
+        write_parquet(table, buffer)
+        s.set(bytes=buffer.tell())
+        buffer.seek(0)
+    
+    s3_key = f"{DATASET_PREFIX}{filename}"
+    
+    with span('upload', key=s3_key) as s:
+        conteudo = rows_hash(dados)
+        if INGESTION_CHECK:
+            # Verificação opcional: sem s3:ListBucket o S3 responde 403 para
+            # chave inexistente, e isso não pode impedir o envio
+            try:
+                metadata = storage_head(s3_key)
+            except Exception as e:
+                print(f"Erro ao verificar {s3_key}, enviando mesmo assim: {e}")
+                metadata = None
+            if metadata and metadata.get(CONTENT_HASH_METADATA) == conteudo:
+                print(f"Conteúdo inalterado, envio pulado: {storage_uri(s3_key)}")
+                _uploads[s3_key] = 'unchanged'
+                s.set(result='unchanged')
+                return storage_uri(s3_key)
         
-        return f"s3://{bucket_name}/{s3_key}"
+        # Upload para S3 (ou diretório local, se B3_DATASET_ROOT)
+        destino = storage_put(s3_key, buffer, {CONTENT_HASH_METADATA: conteudo})
+        _uploads[s3_key] = 'uploaded'
+        s.set(result='uploaded')
+    
+    print(f"Dados salvos: {destino}")
+    
+    return destino
+
+def save_to_parquet(dados, colunas, filename, data_formatada, table=None):
+    """
+    Salva os dados em formato parquet no S3 (table: tabela Arrow já montada).
+    Se o objeto já existe com o mesmo hash de conteúdo, o envio é pulado.
+    """
+    try:
+        return store_dataset_file(dados, colunas, filename, data_formatada, table)
     except Exception as e:
         print(f"Erro ao salvar no S3: {e}")
         return None
 
+def check_partition_prefix(prefix):
+    """
+    Normaliza o prefixo e confere que é de uma partição
+    (data/index=.../year=YYYY/month=MM/); senão, ValueError
+    """
+    prefix = prefix.rstrip('/') + '/'
+    if not re.fullmatch(re.escape(DATASET_PREFIX) + r'index=[^/=.]+/year=\d{4}/month=\d{2}/', prefix):
+        raise ValueError(f"Prefixo de partição inválido para compactação: {prefix}")
+    return prefix
+
+def compact_partition(prefix):
+    """
+    Junta os parquets diários de uma partição (ex.: data/index=IBOV/year=2026/month=10/)
+    em um único arquivo ordenado por Dia e Código, com row groups de
+    COMPACTION_ROW_GROUP_ROWS linhas e estatísticas para predicate pushdown.
+    Os diários são removidos depois da gravação; use em partições já fechadas.
+    Só aceita prefixos de partição (um índice e um mês): no layout flat os
+    índices dividem o mesmo diretório e os dias se misturariam.
+    """
+    pa = lazy_import('pyarrow')
+    pq = lazy_import('pyarrow.parquet')
+    pc = lazy_import('pyarrow.compute')
+    prefix = check_partition_prefix(prefix)
+    destino = prefix + COMPACTED_FILENAME
+    
+    keys = [k for k in storage_list(prefix)
+            if k.endswith('.parquet') and not os.path.basename(k).startswith('b3_delta_')]
+    diarios = [k for k in keys if k != destino]
+    if not diarios:
+        print(f"Nada a compactar em {prefix}")
+        return {'prefix': prefix, 'files': len(keys), 'compacted': False}
+    
+    # O compactado anterior entra primeiro: um dia presente em um arquivo mais
+    # recente substitui por inteiro as linhas desse dia nos anteriores (a
+    # partição é de um único índice, então a chave é (índice, Dia))
+    ordem = ([destino] if destino in keys else []) + sorted(diarios)
+    schema = parquet_schema()
+    tabelas = []
+    dias_vistos = pa.array([], type=pa.date32())
+    for k in reversed(ordem):
+        tabela = pq.read_table(io.BytesIO(storage_get(k))).cast(schema)
+        tabela = tabela.filter(pc.invert(pc.is_in(tabela.column('Dia'), value_set=dias_vistos)))
+        dias_vistos = pa.concat_arrays([dias_vistos, pc.unique(tabela.column('Dia'))])
+        tabelas.append(tabela)
+    table = pa.concat_tables(tabelas).unify_dictionaries().combine_chunks()
+    table = table.take(pc.sort_indices(table, sort_keys=[('Dia', 'ascending'), ('Código', 'ascending')]))
+    
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=PARQUET_COMPRESSION,
+                   row_group_size=COMPACTION_ROW_GROUP_ROWS, write_statistics=True)
+    buffer.seek(0)
+    storage_put(destino, buffer)
+    storage_delete(diarios)
+    
+    resultado = {
+        'prefix': prefix,
+        'files': len(keys),
+        'rows': table.num_rows,
+        'key': storage_uri(destino),
+        'compacted': True,
+    }
+    print(f"Partição compactada: {resultado}")
+    return resultado
+
+def snapshot_day(data_formatada):
+    try:
+        return datetime.strptime(data_formatada, "%d-%m-%y").date()
+    except (TypeError, ValueError):
+        return None
+
+def cache_snapshot(table, dia, index=None):
+    """
+    Guarda o snapshot do dia em /tmp para a próxima invocação quente,
+    mantendo só os SNAPSHOT_CACHE_KEEP dias mais recentes do índice
+    """
+    pq = lazy_import('pyarrow.parquet')
+    base = os.path.join(SNAPSHOT_CACHE_DIR, index or DEFAULT_INDEX)
+    try:
+        os.makedirs(base, exist_ok=True)
+        pq.write_table(table, os.path.join(base, f"{dia:%Y-%m-%d}.parquet"))
+        for antigo in sorted(os.listdir(base))[:-SNAPSHOT_CACHE_KEEP]:
+            os.remove(os.path.join(base, antigo))
+    except OSError as e:
+        print(f"Não foi possível guardar o snapshot em cache: {e}")
+
+def cached_previous_snapshot(dia, index=None):
+    """
+    Snapshot mais recente anterior a `dia` no cache local, ou None
+    """
+    pq = lazy_import('pyarrow.parquet')
+    base = os.path.join(SNAPSHOT_CACHE_DIR, index or DEFAULT_INDEX)
+    try:
+        nomes = sorted(os.listdir(base), reverse=True)
+    except OSError:
+        return None
+    for nome in nomes:
+        if nome < f"{dia:%Y-%m-%d}.parquet":
+            return pq.read_table(os.path.join(base, nome))
+    return None
+
+def stored_snapshot_keys(dia, index=None):
+    """
+    Chaves do dataset que podem ter o snapshot anterior a `dia` (diários do
+    layout atual; no particionado, também o compactado do mês): diários como
+    [(dia, key)], do mais recente para o mais antigo, e compactados como
+    [((ano, mês), key)]. Só lista, não lê os objetos.
+    """
+    if DATASET_LAYOUT == 'partitioned':
+        mes_anterior = (dia.replace(day=1) - timedelta(days=1))
+        prefixos = [partition_prefix(index or DEFAULT_INDEX, d.year, d.month) for d in (dia, mes_anterior)]
+        padrao = re.compile(r'b3_data_(\d{2}-\d{2}-\d{2})\.parquet$')
+    else:
+        prefixos = [DATASET_PREFIX]
+        nome_indice = f"{re.escape(index)}_" if index and index != DEFAULT_INDEX else ''
+        padrao = re.compile(rf'/b3_data_{nome_indice}(\d{{2}}-\d{{2}}-\d{{2}})\.parquet$')
+    
+    diarios, compactados = [], []
+    for prefixo in prefixos:
+        for key in storage_list(prefixo):
+            encontrado = padrao.search(key)
+            if encontrado:
+                dia_key = snapshot_day(encontrado.group(1))
+                if dia_key and dia_key < dia:
+                    diarios.append((dia_key, key))
+            elif key.endswith('/' + COMPACTED_FILENAME):
+                # O compactado pode ter o dia anterior; o mês vem do prefixo
+                mes = re.search(r'year=(\d{4})/month=(\d{2})/', key)
+                compactados.append(((int(mes.group(1)), int(mes.group(2))), key))
+    return sorted(diarios, reverse=True), compactados
+
+def cache_is_current(anterior, chaves):
+    """
+    O snapshot do cache só vale se o dataset não tem um dia anterior mais
+    recente (gravado por outro container): nenhum diário depois dele e
+    nenhum compactado do mesmo mês ou posterior
+    """
+    pc = lazy_import('pyarrow.compute')
+    dia_cache = pc.max(anterior.column('Dia')).as_py()
+    diarios, compactados = chaves
+    if diarios and diarios[0][0] > dia_cache:
+        return False
+    return all(mes < (dia_cache.year, dia_cache.month) for mes, _ in compactados)
+
+def stored_previous_snapshot(dia, index=None, chaves=None):
+    """
+    Snapshot mais recente anterior a `dia` no dataset, ou None
+    (chaves: resultado de stored_snapshot_keys, se já listado)
+    """
+    pa = lazy_import('pyarrow')
+    pq = lazy_import('pyarrow.parquet')
+    pc = lazy_import('pyarrow.compute')
+    diarios, compactados = chaves or stored_snapshot_keys(dia, index)
+    
+    melhor = diarios[0] if diarios else None
+    for _, key in compactados:
+        tabela = pq.read_table(io.BytesIO(storage_get(key))).cast(parquet_schema())
+        tabela = tabela.filter(pc.less(tabela.column('Dia'), pa.scalar(dia, pa.date32())))
+        if tabela.num_rows == 0:
+            continue
+        dia_key = pc.max(tabela.column('Dia')).as_py()
+        if melhor is None or dia_key > melhor[0]:
+            return tabela.filter(pc.equal(tabela.column('Dia'), pa.scalar(dia_key, pa.date32())))
+    if melhor is None:
+        return None
+    return pq.read_table(io.BytesIO(storage_get(melhor[1]))).cast(parquet_schema())
+
+def composition_delta(anterior, atual):
+    """
+    Diferença vetorizada entre dois snapshots (join externo por Código):
+    Mudança = 'entrada', 'saida' ou 'peso' (Qtde. Teórica ou Part. (%) mudou).
+    Linhas iguais nos dois dias não entram no delta.
+    """
+    pa = lazy_import('pyarrow')
+    pc = lazy_import('pyarrow.compute')
+    colunas = ['Código', 'Ação', 'Qtde. Teórica', 'Part. (%)', 'Dia']
+    
+    def lado(tabela, sufixo):
+        tabela = tabela.select(colunas)
+        tabela = tabela.append_column(f'presente{sufixo}', pa.repeat(pa.scalar(True), tabela.num_rows))
+        return tabela.rename_columns(['Código'] + [f'{c}{sufixo}' for c in colunas[1:]] + [f'presente{sufixo}'])
+    
+    juntos = lado(atual, '').join(lado(anterior, ' anterior'), 'Código', join_type='full outer')
+    entrou = pc.is_null(juntos.column('presente anterior'))
+    saiu = pc.is_null(juntos.column('presente'))
+    
+    def mudou(coluna):
+        diferente = pc.not_equal(juntos.column(coluna), juntos.column(f'{coluna} anterior'))
+        # Nulo de um lado só também conta como mudança
+        um_nulo = pc.xor(pc.is_null(juntos.column(coluna)), pc.is_null(juntos.column(f'{coluna} anterior')))
+        return pc.or_(pc.fill_null(diferente, False), um_nulo)
+    
+    peso = pc.and_(pc.invert(pc.or_(entrou, saiu)),
+                   pc.or_(mudou('Qtde. Teórica'), mudou('Part. (%)')))
+    mudanca = pc.if_else(entrou, 'entrada', pc.if_else(saiu, 'saida', pc.if_else(peso, 'peso', None)))
+    
+    delta = pa.table({
+        'Código': juntos.column('Código'),
+        'Ação': pc.coalesce(juntos.column('Ação'), juntos.column('Ação anterior')),
+        'Mudança': mudanca,
+        'Qtde. Teórica anterior': juntos.column('Qtde. Teórica anterior'),
+        'Qtde. Teórica': juntos.column('Qtde. Teórica'),
+        'Variação Qtde.': pc.subtract(juntos.column('Qtde. Teórica'), juntos.column('Qtde. Teórica anterior')),
+        'Part. (%) anterior': juntos.column('Part. (%) anterior'),
+        'Part. (%)': juntos.column('Part. (%)'),
+        'Variação Part. (%)': pc.subtract(juntos.column('Part. (%)'), juntos.column('Part. (%) anterior')),
+        'Dia anterior': pc.coalesce(juntos.column('Dia anterior'),
+                                    pa.repeat(pc.max(anterior.column('Dia')), juntos.num_rows)),
+        'Dia': pc.coalesce(juntos.column('Dia'), pa.repeat(pc.max(atual.column('Dia')), juntos.num_rows)),
+    })
+    delta = delta.filter(pc.is_valid(mudanca))
+    delta = delta.take(pc.sort_indices(delta, sort_keys=[('Mudança', 'ascending'), ('Código', 'ascending')]))
+    return delta.set_column(2, 'Mudança', pc.dictionary_encode(delta.column('Mudança')))
+
+def diff_with_previous(table, filename, data_formatada, index=None):
+    """
+    Compara o snapshot do dia com o anterior (cache local ou dataset), grava o
+    delta ao lado do snapshot e devolve as contagens para o consumidor decidir
+    se precisa reprocessar o dia
+    """
+    if not DIFF_ENABLED:
+        return None
+    pc = lazy_import('pyarrow.compute')
+    dia = snapshot_day(data_formatada)
+    if dia is None:
+        return None
+    
+    try:
+        with span('diff', index=index or DEFAULT_INDEX) as s:
+            chaves = stored_snapshot_keys(dia, index)
+            anterior = cached_previous_snapshot(dia, index)
+            origem = 'cache'
+            if anterior is None or not cache_is_current(anterior, chaves):
+                anterior = stored_previous_snapshot(dia, index, chaves)
+                origem = 'dataset'
+            cache_snapshot(table, dia, index)
+            
+            if anterior is None or anterior.num_rows == 0:
+                print("Sem snapshot anterior para comparar")
+                return {'previous_date': None}
+            
+            delta = composition_delta(anterior, table)
+            contagem = pc.value_counts(delta.column('Mudança')).to_pylist() if delta.num_rows else []
+            contagem = {item['values']: item['counts'] for item in contagem}
+            resumo = {
+                'previous_date': pc.max(anterior.column('Dia')).as_py().strftime("%d-%m-%y"),
+                'previous_source': origem,
+                'added': contagem.get('entrada', 0),
+                'removed': contagem.get('saida', 0),
+                'weight_changed': contagem.get('peso', 0),
+                'changed': delta.num_rows > 0,
+                'delta_path': None,
+            }
+            
+            if delta.num_rows:
+                pasta, nome = os.path.split(filename)
+                delta_key = f"{DATASET_PREFIX}{os.path.join(pasta, nome.replace('b3_data_', 'b3_delta_', 1))}"
+                buffer = io.BytesIO()
+                write_parquet(delta, buffer)
+                buffer.seek(0)
+                resumo['delta_path'] = storage_put(delta_key, buffer)
+            s.set(**{k: v for k, v in resumo.items() if k in ('added', 'removed', 'weight_changed')})
+    except Exception as e:
+        print(f"Erro no diff com o dia anterior: {e}")
+        return {'error': str(e)}
+    
+    print(f"Diff com {resumo['previous_date']}: {resumo}")
+    return resumo
+
 # Para Lambda
 def lambda_handler(event, context):
     """
@@ -430,16 +2628,94 @@ def lambda_handler(event, context):
     """
     try:
         print("=== Iniciando Lambda Handler ===")
+        _init_timing['invocations'] += 1
+        init = dict(_init_timing, cold=_init_timing['invocations'] == 1)
+        print(f"Init: {init}")
+        
+        _browser['last_start'] = None
+        _network_stats.clear()
+        _completeness.clear()
+        _spans.clear()
+        reset_memory()
+        mode = event.get('mode') if isinstance(event, dict) else None
+        indices = event.get('indices') if isinstance(event, dict) else None
+        force = bool(event.get('force')) if isinstance(event, dict) else False
+        
+        if isinstance(event, dict) and event.get('action') == 'compact':
+            # Compactação de uma partição: {"action": "compact", "index": "IBOV", "year": 2026, "month": 9}
+            try:
+                prefix = check_partition_prefix(partition_prefix(
+                    event.get('index') or DEFAULT_INDEX, event['year'], event['month']))
+            except (KeyError, ValueError) as e:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': f"Compactação inválida: {e}"})
+                }
+            return {
+                'statusCode': 200,
+                'body': json.dumps(compact_partition(prefix))
+            }
+        
+        batch_mode = (event.get('batch_mode') if isinstance(event, dict) else None) or BATCH_MODE
+        if indices and batch_mode == 'pipeline':
+            # Vários índices em sequência no browser, gravação em pipeline
+            resultados, resumo = scrape_and_save_pipelined(indices, mode, force)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': f"{resumo.get('ok', 0)} de {len(resultados)} índices gravados, "
+                               f"{resumo.get('skipped', 0)} já ingeridos, {resumo.get('error', 0)} com erro",
+                    'summary': resumo,
+                    'network': _network_stats or None,
+                    'init': init,
+                    'spans': span_summary(),
+                    'memory': memory_summary(),
+                    'results': resultados
+                }, default=str)
+            }
+        
+        if indices:
+            # Vários índices em paralelo, um parquet por índice
+            inicio = time.perf_counter()
+            resultados, network = scrape_and_save_indices(indices, mode, force)
+            ok = sum(1 for r in resultados if r['status'] == 'ok')
+            pulados = sum(1 for r in resultados if r['status'] == 'skipped')
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': f'{ok} de {len(resultados)} índices extraídos com sucesso, {pulados} já ingeridos',
+                    'seconds': round(time.perf_counter() - inicio, 3),
+                    'network': network,
+                    'init': init,
+                    'spans': span_summary(),
+                    'memory': memory_summary(),
+                    'results': resultados
+                })
+            }
+        
+        # Carteira do dia já no S3: nem abre o browser
+        data_ingerida = None if force else already_ingested(dataset_filename)
+        if data_ingerida:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': f'Carteira de {data_ingerida} já ingerida, nada a fazer',
+                    'data_formatada': data_ingerida,
+                    'skipped': 'already_ingested',
+                    'init': init,
+                    'spans': span_summary()
+                })
+            }
         
-        dados, colunas, data_formatada = scrape_b3_data()
+        dados, colunas, data_formatada = scrape_b3_data(mode)
         
         if dados:
             # Salvar no S3 se houver dados
-            filename = f"b3_data_{data_formatada}.parquet"
-            s3_path = save_to_parquet(dados, colunas, filename, data_formatada)
-            
-            # Converter para formato JSON para retorno
-            df = pd.DataFrame(dados, columns=colunas)
+            filename = dataset_filename(data_formatada)
+            with span('normalization', rows=len(dados)):
+                table = build_arrow_table(dados, colunas, data_formatada)
+            s3_path = save_to_parquet(dados, colunas, filename, data_formatada, table=table)
+            diff = diff_with_previous(table, filename, data_formatada) if s3_path else None
             
             return {
                 'statusCode': 200,
@@ -447,8 +2723,16 @@ def lambda_handler(event, context):
                     'message': f'Dados extraídos com sucesso: {len(dados)} registros',
                     'data_formatada': data_formatada,
                     's3_path': s3_path,
-                    'sample_data': df.head(5).to_dict('records')
-                })
+                    'upload': _uploads.get(f"{DATASET_PREFIX}{filename}"),
+                    'diff': diff,
+                    'browser_start': _browser['last_start'],
+                    'network': _network_stats or None,
+                    'completeness': _completeness or None,
+                    'init': init,
+                    'spans': span_summary(),
+                    'memory': memory_summary(),
+                    'sample_data': table.slice(0, 5).to_pylist()
+                }, default=str)
             }
         else:
             return {
@@ -456,6 +2740,11 @@ def lambda_handler(event, context):
                 'body': json.dumps({
                     'message': 'Scraping executado mas nenhum dado extraído',
                     'data_formatada': data_formatada,
+                    'browser_start': _browser['last_start'],
+                    'network': _network_stats or None,
+                    'init': init,
+                    'spans': span_summary(),
+                    'memory': memory_summary(),
                     'dados_count': 0
                 })
             }
@@ -471,6 +2760,8 @@ def lambda_handler(event, context):
             })
         }
 
+_init_timing['module_import_s'] = round(time.perf_counter() - _MODULE_START, 3)
+
 def main():
     """
     Função principal para teste local
@@ -478,19 +2769,20 @@ def main():
     print("=== B3 Scraper com Playwright - Dados Completos ===")
     
     dados, colunas, data_formatada = scrape_b3_data()
+    shutdown_browser()
     
     if dados:
         filename = f"b3_data_{data_formatada}.parquet"
         
         # Para teste local, só mostrar os dados sem salvar no S3
-        df = pd.DataFrame(dados, columns=colunas)
-        df['Dia'] = data_formatada
+        table = build_arrow_table(dados, colunas, data_formatada)
         
         print(f"Dados extraídos: {len(dados)} registros")
-        print(df.head())
+        print(table.slice(0, 5).to_pylist())
         
         # Salvar localmente para teste
-        df.to_parquet(f"./data/{filename}", engine='pyarrow')
+        with open(f"./data/{filename}", 'wb') as f:
+            write_parquet(table, f)
         print(f"Dados salvos localmente: ./data/{filename}")
     else:
         print("Nenhum dado extraído")
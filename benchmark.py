@@ -0,0 +1,594 @@
+"""
+Benchmarks locais do scraper da B3 (sem acesso ao site real)
+
+Uso:
+    python benchmark.py --rows 90
+    python benchmark.py --suite parquet --rows 5000
+    python benchmark.py --suite pipeline --mode dom --rows 90
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from playwright.sync_api import sync_playwright
+
+import app
+
+# Baselines versionados da suite pipeline (chave: modo:linhas:latência:layout:perfil)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+SETORES = ["Bens Indls", "Cons N Ciclico", "Financ e Outros", "Mats Basicos", "Petroleo"]
+
+def build_fixture_html(rows=90):
+    """
+    Gera uma tabela no formato da carteira teórica com `rows` linhas x 7 colunas
+    """
+    linhas = []
+    for i in range(rows):
+        qtde = f"{(i + 1) * 1234567:,}".replace(",", ".")
+        part = f"{(i % 10) + 0.123:.3f}".replace(".", ",")
+        acum = f"{i * 0.5:.3f}".replace(".", ",")
+        linhas.append(
+            "<tr>"
+            f"<td>{SETORES[i % len(SETORES)]}</td>"
+            f"<td>TST{i:03d}3</td>"
+            f"<td>ACAO {i}</td>"
+            "<td>ON NM</td>"
+            f"<td>{qtde}</td>"
+            f"<td>{part}</td>"
+            f"<td>{acum}</td>"
+            "</tr>"
+        )
+    return f"""<!DOCTYPE html>
+<html><body>
+<div id="divContainerIframeB3"><form>
+<h2>Carteira do Dia - 18/10/26</h2>
+<table class="table">
+<thead><tr><th>Setor</th><th>Código</th><th>Ação</th><th>Tipo</th><th>Qtde. Teórica</th><th>Part. (%)</th><th>Part. (%)Acum.</th></tr></thead>
+<tbody>{''.join(linhas)}</tbody>
+</table>
+</form></div>
+</body></html>"""
+
+def legacy_extract(page, limit=100):
+    """
+    Réplica do laço antigo (locator por célula), contando as idas ao browser
+    """
+    roundtrips = 0
+    dados = []
+
+    table_count = page.locator('table').count()
+    roundtrips += 1
+
+    for table_idx in range(table_count):
+        table = page.locator('table').nth(table_idx)
+        for row_selector in ['tbody tr', 'tr']:
+            rows = table.locator(row_selector)
+            row_count = rows.count()
+            roundtrips += 1
+            for i in range(min(row_count, limit)):
+                cells = rows.nth(i).locator('td')
+                cell_count = cells.count()
+                roundtrips += 1
+                row_data = []
+                for j in range(cell_count):
+                    row_data.append(cells.nth(j).text_content().strip())
+                    roundtrips += 1
+                if any(cell.strip() for cell in row_data):
+                    dados.append(row_data)
+            if dados:
+                break
+        if dados:
+            break
+
+    return dados, roundtrips
+
+def bench_table_extraction(page, repeats=3):
+    """
+    Compara o laço antigo com a extração em lote (evaluate e snapshot HTML)
+    """
+    resultados = {}
+
+    inicio = time.perf_counter()
+    for _ in range(repeats):
+        dados, roundtrips = legacy_extract(page)
+    resultados['legacy'] = {
+        'rows': len(dados),
+        'roundtrips': roundtrips,
+        'seconds': (time.perf_counter() - inicio) / repeats,
+    }
+
+    for engine in ('evaluate', 'html'):
+        inicio = time.perf_counter()
+        with BrowserRoundtrips() as roundtrips:
+            for _ in range(repeats):
+                dados = app.extract_table_rows(page, engine=engine)
+        resultados[engine] = {
+            'rows': len(dados),
+            'roundtrips': roundtrips.count // repeats,
+            'seconds': (time.perf_counter() - inicio) / repeats,
+        }
+
+    return resultados
+
+def bench_parquet(rows=90, repeats=5):
+    """
+    Compara o parquet só com strings (formato antigo, que o pandas gravava)
+    com o parquet tipado montado direto em Arrow
+    """
+    _, _, dados = app.locate_table(app.parse_tables_html(build_fixture_html(rows)))
+    resultados = {}
+    # Primeira escrita fora da medição (imports e inicialização do pyarrow)
+    app.write_parquet(app.build_arrow_table(dados[:1], app.COLUNAS, '18-10-26'), io.BytesIO())
+
+    for nome in ('strings', 'typed_snappy', 'typed_zstd'):
+        buffer = io.BytesIO()
+
+        inicio = time.perf_counter()
+        if nome == 'strings':
+            # Formato antigo: todas as colunas como texto, inclusive Dia
+            colunas = list(zip(*dados))
+            table = pa.table({nome_coluna: pa.array(valores, pa.string())
+                              for nome_coluna, valores in zip(app.COLUNAS, colunas)})
+            table = table.append_column('Dia', pa.array(['18-10-26'] * len(dados), pa.string()))
+            pq.write_table(table, buffer)
+        else:
+            table = app.build_arrow_table(dados, app.COLUNAS, '18-10-26')
+            app.write_parquet(table, buffer, compression=nome.split('_')[1])
+        write_seconds = time.perf_counter() - inicio
+
+        payload = buffer.getvalue()
+        inicio = time.perf_counter()
+        for _ in range(repeats):
+            pq.read_table(io.BytesIO(payload))
+        read_seconds = (time.perf_counter() - inicio) / repeats
+
+        resultados[nome] = {
+            'rows': len(dados),
+            'bytes': len(payload),
+            'write_seconds': write_seconds,
+            'read_seconds': read_seconds,
+        }
+
+    return resultados
+
+# Réplica da página do índice: como no site real, a carteira fica em um
+# iframe dentro de #divContainerIframeB3 (layout 'iframe'); o layout 'inline'
+# coloca a carteira direto no documento principal
+REPLICA_PAGE_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Índice {index}</title></head><body>
+<div id="divContainerIframeB3">
+<iframe id="bvmf_iframe" src="/frame/day/{index}?language=pt-br"></iframe>
+</div>
+</body></html>"""
+
+# Documento da carteira: a tabela é preenchida pela chamada GetPortfolioDay,
+# como no site real, e responde aos selects e à paginação
+REPLICA_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Índice {index}</title></head><body>
+<div id="divContainerIframeB3">
+<form>
+<h2></h2>
+<select id="segment" name="segment">
+<option value="1">Setor de Atuação</option><option value="2">Código</option>
+</select>
+<select id="selectPage" name="selectPage">
+<option value="20">20</option><option value="40">40</option><option value="60">60</option><option value="120">120</option>
+</select>
+<table class="table">
+<thead><tr><th>Setor</th><th>Código</th><th>Ação</th><th>Tipo</th><th>Qtde. Teórica</th><th>Part. (%)</th><th>Part. (%)Acum.</th></tr></thead>
+<tbody></tbody>
+<tfoot></tfoot>
+</table>
+<ul class="ngx-pagination"></ul>
+</form>
+</div>
+<script>
+const INDEX = "{index}";
+let pageNumber = 1;
+async function load() {{
+    const params = {{language: 'pt-br', pageNumber: pageNumber,
+        pageSize: parseInt(document.getElementById('selectPage').value, 10),
+        index: INDEX, segment: document.getElementById('segment').value}};
+    const response = await fetch('/indexProxy/indexCall/GetPortfolioDay/' + btoa(JSON.stringify(params)));
+    const data = await response.json();
+    document.querySelector('h2').textContent = 'Carteira do Dia - ' + data.header.date;
+    document.querySelector('tbody').innerHTML = data.results.map(r =>
+        '<tr><td>' + [r.segment, r.cod, r.asset, r.type, r.theoricalQty, r.part, r.partAcum].join('</td><td>') + '</td></tr>'
+    ).join('');
+    document.querySelector('tfoot').innerHTML =
+        '<tr><td colspan="4">Quantidade Teórica Total</td><td>' + data.header.theoricalQty + '</td><td>' + data.header.part + '</td><td></td></tr>' +
+        '<tr><td colspan="4">Redutor</td><td>' + data.header.reductor + '</td><td></td><td></td></tr>';
+    let items = '';
+    for (let n = 1; n <= data.page.totalPages; n++) {{
+        items += n === pageNumber ? '<li class="current"><span>' + n + '</span></li>' : '<li><a href="#" data-page="' + n + '">' + n + '</a></li>';
+    }}
+    if (pageNumber < data.page.totalPages) {{
+        items += '<li class="pagination-next"><a href="#">Próxima</a></li>';
+    }}
+    document.querySelector('.ngx-pagination').innerHTML = items;
+}}
+document.querySelector('.ngx-pagination').addEventListener('click', event => {{
+    event.preventDefault();
+    const link = event.target.closest('a');
+    if (!link) return;
+    pageNumber = link.dataset.page ? parseInt(link.dataset.page, 10) : pageNumber + 1;
+    load();
+}});
+document.getElementById('segment').addEventListener('change', () => {{ pageNumber = 1; load(); }});
+document.getElementById('selectPage').addEventListener('change', () => {{ pageNumber = 1; load(); }});
+load();
+</script>
+</body></html>"""
+
+def build_portfolio_results(rows):
+    """
+    Linhas da carteira no formato do JSON da B3
+    """
+    resultados = []
+    for i in range(rows):
+        resultados.append({
+            'segment': SETORES[i % len(SETORES)],
+            'cod': f"TST{i:03d}3",
+            'asset': f"ACAO {i}",
+            'type': 'ON NM',
+            'theoricalQty': f"{(i + 1) * 1234567:,}".replace(",", "."),
+            'part': f"{(i % 10) + 0.123:.3f}".replace(".", ","),
+            'partAcum': f"{i * 0.5:.3f}".replace(".", ","),
+        })
+    return resultados
+
+class ReplicaServer:
+    """
+    Servidor HTTP local que imita a página do índice e a API da carteira,
+    contando as requisições recebidas por tipo
+    """
+
+    def __init__(self, rows=90, latency_ms=50, date='18/10/26', layout='iframe'):
+        self.results = build_portfolio_results(rows)
+        self.latency_ms = latency_ms
+        self.date = date
+        self.layout = layout
+        self.requests = {'page': 0, 'frame': 0, 'api': 0, 'other': 0}
+        self.api_indices = []
+        self._lock = threading.Lock()
+        total = sum((i + 1) * 1234567 for i in range(rows))
+        self.header = {
+            'date': date,
+            'text': 'Quantidade Teórica Total',
+            'part': '100,000',
+            'theoricalQty': f"{total:,}".replace(",", "."),
+            'textReductor': 'Redutor',
+            'reductor': '15.432.123,45678901',
+        }
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def _count(self, tipo):
+        with self._lock:
+            self.requests[tipo] += 1
+
+    def portfolio_payload(self, params):
+        page_size = int(params.get('pageSize') or 20)
+        page_number = int(params.get('pageNumber') or 1)
+        total_pages = max(1, -(-len(self.results) // page_size))
+        inicio = (page_number - 1) * page_size
+        return {
+            'page': {
+                'pageNumber': page_number,
+                'pageSize': page_size,
+                'totalRecords': len(self.results),
+                'totalPages': total_pages,
+            },
+            'header': self.header,
+            'results': self.results[inicio:inicio + page_size],
+        }
+
+    def _handler(self):
+        replica = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith('/indexPage/day/'):
+                    replica._count('page')
+                    index = self.path.split('/')[3].split('?')[0]
+                    html = REPLICA_PAGE_HTML if replica.layout == 'iframe' else REPLICA_HTML
+                    self._send(200, html.format(index=index).encode('utf-8'), 'text/html; charset=utf-8')
+                elif self.path.startswith('/frame/day/'):
+                    replica._count('frame')
+                    index = self.path.split('/')[3].split('?')[0]
+                    self._send(200, REPLICA_HTML.format(index=index).encode('utf-8'), 'text/html; charset=utf-8')
+                elif self.path.startswith(app.PORTFOLIO_API_PATH):
+                    replica._count('api')
+                    time.sleep(replica.latency_ms / 1000)
+                    encoded = self.path.rsplit('/', 1)[1]
+                    params = json.loads(base64.b64decode(encoded + '=' * (-len(encoded) % 4)))
+                    replica.api_indices.append(params.get('index'))
+                    body = json.dumps(replica.portfolio_payload(params)).encode('utf-8')
+                    self._send(200, body, 'application/json')
+                else:
+                    replica._count('other')
+                    self._send(200, b'<html><body></body></html>', 'text/html')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def api_url(self, index='IBOV', page_size=20):
+        params = {'language': 'pt-br', 'pageNumber': 1, 'pageSize': page_size, 'index': index, 'segment': '1'}
+        encoded = base64.b64encode(json.dumps(params).encode()).decode()
+        return f"{self.base_url}{app.PORTFOLIO_API_PATH}{encoded}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class BrowserRoundtrips:
+    """
+    Conta as mensagens enviadas ao driver do Playwright (idas ao browser)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._original = None
+
+    def __enter__(self):
+        from playwright._impl import _connection
+        self._connection = _connection.Connection
+        self._original = self._connection._send_message_to_server
+        contador = self
+
+        def send(conn, *args, **kwargs):
+            contador.count += 1
+            return contador._original(conn, *args, **kwargs)
+
+        self._connection._send_message_to_server = send
+        return self
+
+    def __exit__(self, *exc):
+        self._connection._send_message_to_server = self._original
+
+def peak_rss_mb():
+    """
+    Pico de RSS do processo Python e dos filhos já encerrados (MB)
+    """
+    proprio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {'python': round(proprio, 1), 'children': round(filhos, 1)}
+
+def bench_pipeline(rows=90, mode='dom', latency_ms=50, profile=None, layout='iframe'):
+    """
+    Executa scrape -> normalização -> parquet -> S3 (moto) contra a réplica
+    local e mede cada fase. O scrape roda duas vezes: a primeira descobre a
+    página (iframe, seletores) e a segunda usa a estratégia aprendida (frame
+    direto). A gravação passa pelo caminho real (store_dataset_file, com hash
+    e head_object). profile: perfil de lançamento do Chromium.
+    """
+    from moto import mock_aws
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ['S3_BUCKET_NAME'] = 'b3-benchmark'
+
+    cache_dir = tempfile.mkdtemp(prefix="b3_bench_")
+    app.PORTFOLIO_REQUEST_CACHE = os.path.join(cache_dir, 'portfolio_request.json')
+    app.PAGE_STRATEGY_CACHE = os.path.join(cache_dir, 'page_strategy.json')
+    app.SNAPSHOT_CACHE_DIR = os.path.join(cache_dir, 'snapshots')
+    if profile:
+        app.LAUNCH_PROFILE = profile
+    app.reset_memory()
+
+    # Importa o pyarrow (e monta uma tabela pequena) antes de medir, para a
+    # fase de normalização não carregar o custo do primeiro import
+    app.write_parquet(app.build_arrow_table([["Setor", "TST0013", "ACAO", "ON", "1", "1,0", "1,0"]],
+                                            app.COLUNAS, "18-10-26"), io.BytesIO())
+
+    with ReplicaServer(rows, latency_ms, layout=layout) as replica, mock_aws():
+        app.B3_BASE_URL = replica.base_url
+        app.ALLOWED_DOMAINS.add('127.0.0.1')
+        app._s3_client = None
+        app.get_s3_client().create_bucket(Bucket='b3-benchmark')
+        if mode == 'http':
+            # Modo HTTP direto parte de uma requisição já capturada
+            app.store_portfolio_request(replica.api_url(), {})
+
+        fases = {}
+        with BrowserRoundtrips() as roundtrips:
+            inicio = time.perf_counter()
+            dados, colunas, data_formatada = app.scrape_b3_data(mode)
+            fases['scrape'] = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            dados, colunas, data_formatada = app.scrape_b3_data(mode)
+            fases['scrape_learned'] = time.perf_counter() - inicio
+            app.shutdown_browser()
+        strategy = app.load_page_strategy()
+
+        inicio = time.perf_counter()
+        table = app.build_arrow_table(dados, colunas, data_formatada)
+        fases['normalize'] = time.perf_counter() - inicio
+
+        app._spans.clear()
+        app.store_dataset_file(dados, colunas, app.dataset_filename(data_formatada), data_formatada, table)
+        for registro in app._spans:
+            fases[registro['span']] = registro['duration_ms'] / 1000
+
+    return {
+        'mode': mode,
+        'layout': layout,
+        'profile': app.LAUNCH_PROFILE,
+        'latency_ms': latency_ms,
+        'rows': len(dados),
+        'expected_rows': rows,
+        'phases_seconds': {fase: round(segundos, 4) for fase, segundos in fases.items()},
+        'total_seconds': round(sum(fases.values()), 4),
+        'browser_roundtrips': roundtrips.count,
+        'site_requests': dict(replica.requests),
+        'direct_frame': bool(app.direct_frame_url(strategy)),
+        'peak_rss_mb': peak_rss_mb(),
+        'memory': app.memory_summary(),
+    }
+
+def bench_profiles(rows=90, mode='dom', latency_ms=50):
+    """
+    Roda a suite pipeline com cada perfil de lançamento e compara pico de
+    RSS (Python + árvore do browser, amostrado durante as fases) e duração
+    """
+    resultados = {}
+    for profile in app.LAUNCH_PROFILES:
+        app.shutdown_browser()
+        resultado = bench_pipeline(rows, mode, latency_ms, profile)
+        resultados[profile] = {
+            'rows': resultado['rows'],
+            'total_seconds': resultado['total_seconds'],
+            'scrape_seconds': resultado['phases_seconds']['scrape'],
+            'peak_rss_mb': resultado['memory'],
+        }
+    return resultados
+
+def baseline_key(resultado):
+    """
+    Chave da configuração no arquivo de baseline (modo, linhas, latência,
+    layout da réplica e perfil de lançamento)
+    """
+    return (f"{resultado['mode']}:{resultado['expected_rows']}:{resultado['latency_ms']}ms:"
+            f"{resultado['layout']}:{resultado['profile']}")
+
+def load_baselines(baseline_path):
+    if not os.path.exists(baseline_path):
+        return {}
+    with open(baseline_path) as f:
+        return json.load(f)
+
+def update_baseline(resultado, baseline_path):
+    """
+    Grava o resultado como baseline da sua configuração, mantendo as demais
+    """
+    baselines = load_baselines(baseline_path)
+    baselines[baseline_key(resultado)] = {
+        campo: resultado[campo]
+        for campo in ('rows', 'phases_seconds', 'total_seconds', 'browser_roundtrips', 'site_requests')
+    }
+    with open(baseline_path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def check_baseline(resultado, baseline_path, tolerance=0.25):
+    """
+    Compara o resultado com o baseline gravado para a mesma configuração:
+    tempos podem piorar até `tolerance`; contagens de idas ao browser/site e
+    linhas não podem piorar. Devolve None se não há baseline da configuração.
+    """
+    baseline = load_baselines(baseline_path).get(baseline_key(resultado))
+    if baseline is None:
+        return None
+
+    regressoes = []
+    if resultado['rows'] < baseline['rows']:
+        regressoes.append(f"rows: {resultado['rows']} < {baseline['rows']}")
+    if resultado['total_seconds'] > baseline['total_seconds'] * (1 + tolerance) \
+            and resultado['total_seconds'] - baseline['total_seconds'] > 0.05:
+        regressoes.append(f"total_seconds: {resultado['total_seconds']} > {baseline['total_seconds']} (+{tolerance:.0%})")
+    for fase, segundos in baseline['phases_seconds'].items():
+        atual = resultado['phases_seconds'].get(fase)
+        if atual is not None and atual > segundos * (1 + tolerance) and atual - segundos > 0.05:
+            regressoes.append(f"{fase}: {atual}s > {segundos}s (+{tolerance:.0%})")
+    if resultado['browser_roundtrips'] > baseline['browser_roundtrips']:
+        regressoes.append(f"browser_roundtrips: {resultado['browser_roundtrips']} > {baseline['browser_roundtrips']}")
+    for tipo, quantidade in baseline['site_requests'].items():
+        if resultado['site_requests'].get(tipo, 0) > quantidade:
+            regressoes.append(f"site_requests.{tipo}: {resultado['site_requests'][tipo]} > {quantidade}")
+    return regressoes
+
+def bench_table(rows, repeats):
+    """
+    Abre a fixture local no Chromium e mede a extração da tabela
+    """
+    fixture_dir = tempfile.mkdtemp(prefix="b3_bench_")
+    fixture_path = os.path.join(fixture_dir, "index.html")
+    with open(fixture_path, "w", encoding="utf-8") as f:
+        f.write(build_fixture_html(rows))
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True, args=['--no-sandbox'])
+        page = browser.new_page()
+        page.goto(f"file://{fixture_path}")
+        resultados = bench_table_extraction(page, repeats)
+        browser.close()
+
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local do scraper da B3")
+    parser.add_argument('--rows', type=int, default=90)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--suite', choices=['all', 'table', 'parquet', 'pipeline', 'profiles'], default='all')
+    parser.add_argument('--mode', choices=['dom', 'capture', 'http'], default='dom',
+                        help="modo de extração usado na suite pipeline")
+    parser.add_argument('--latency-ms', type=int, default=50, help="latência simulada da API da réplica")
+    parser.add_argument('--profile', choices=list(app.LAUNCH_PROFILES),
+                        help="perfil de lançamento do Chromium na suite pipeline")
+    parser.add_argument('--layout', choices=['iframe', 'inline'], default='iframe',
+                        help="carteira dentro do iframe (como na B3) ou no documento principal")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help="JSON de baselines da suite pipeline, por configuração")
+    parser.add_argument('--update-baseline', action='store_true', help="grava o resultado como novo baseline")
+    parser.add_argument('--allow-missing-baseline', action='store_true',
+                        help="só avisa (em vez de falhar) se a configuração não tem baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    resultados = {}
+    if args.suite in ('all', 'parquet'):
+        resultados['parquet'] = bench_parquet(args.rows, args.repeats)
+    if args.suite in ('all', 'table'):
+        resultados['table_extraction'] = bench_table(args.rows, args.repeats)
+    if args.suite in ('all', 'pipeline'):
+        resultados['pipeline'] = bench_pipeline(args.rows, args.mode, args.latency_ms, args.profile, args.layout)
+    if args.suite == 'profiles':
+        resultados['profiles'] = bench_profiles(args.rows, args.mode, args.latency_ms)
+
+    print(json.dumps(resultados, indent=2))
+
+    if args.baseline and 'pipeline' in resultados:
+        chave = baseline_key(resultados['pipeline'])
+        if args.update_baseline:
+            update_baseline(resultados['pipeline'], args.baseline)
+            print(f"Baseline de {chave} gravado em {args.baseline}", file=sys.stderr)
+        else:
+            regressoes = check_baseline(resultados['pipeline'], args.baseline, args.tolerance)
+            if regressoes is None:
+                print(f"Sem baseline para {chave} em {args.baseline} (grave com --update-baseline)", file=sys.stderr)
+                if not args.allow_missing_baseline:
+                    sys.exit(1)
+            elif regressoes:
+                print("Regressões em relação ao baseline:", file=sys.stderr)
+                for regressao in regressoes:
+                    print(f"  - {regressao}", file=sys.stderr)
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
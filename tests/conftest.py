@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import benchmark  # noqa: E402
+
+BUCKET = 'b3-scraper-tests'
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """
+    Caches de /tmp em um diretório temporário e estado de módulo zerado
+    """
+    monkeypatch.setattr(app, 'METRICS_FORMAT', 'off')
+    monkeypatch.setattr(app, 'PORTFOLIO_REQUEST_CACHE', str(tmp_path / 'portfolio_request.json'))
+    monkeypatch.setattr(app, 'PAGE_STRATEGY_CACHE', str(tmp_path / 'page_strategy.json'))
+    monkeypatch.setattr(app, 'SNAPSHOT_CACHE_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(app, '_s3_client', None)
+    app._uploads.clear()
+    yield
+    app.shutdown_browser()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """
+    Bucket S3 simulado com moto
+    """
+    from moto import mock_aws
+
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('S3_BUCKET_NAME', BUCKET)
+    with mock_aws():
+        client = app.get_s3_client()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    """
+    Réplica local da página e da API da carteira (ver benchmark.py), com a
+    requisição da carteira já capturada para o modo HTTP
+    """
+    with benchmark.ReplicaServer(rows=30, latency_ms=0) as server:
+        monkeypatch.setattr(app, 'B3_BASE_URL', server.base_url)
+        monkeypatch.setattr(app, 'ALLOWED_DOMAINS', app.ALLOWED_DOMAINS | {'127.0.0.1'})
+        app.store_portfolio_request(server.api_url(), {})
+        yield server
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """
+    Dataset em um diretório local (B3_DATASET_ROOT) no lugar do bucket
+    """
+    root = tmp_path / 'dataset'
+    monkeypatch.setattr(app, 'DATASET_ROOT', str(root))
+    return root
+
+
+@pytest.fixture
+def browser():
+    """
+    Chromium do Playwright; os testes de DOM são pulados sem o browser instalado
+    """
+    try:
+        app.acquire_browser_context()
+    except Exception as e:
+        app.shutdown_browser()
+        pytest.skip(f"Chromium indisponível: {e}")
+    yield
@@ -0,0 +1,40 @@
+import datetime
+
+import pyarrow as pa
+
+import app
+
+
+def test_to_number_array_parses_brazilian_formats():
+    inteiros = app.to_number_array(['1.234.567', ' 42 ', '-7', '', '1,5', 'abc', None], pa.int64())
+    decimais = app.to_number_array(['12,345', '1.234,5', '-0,25', '7', '', '1,2,3', 'x'], pa.float64())
+
+    assert inteiros.type == pa.int64()
+    assert inteiros.to_pylist() == [1234567, 42, -7, None, None, None, None]
+    assert decimais.type == pa.float64()
+    assert decimais.to_pylist() == [12.345, 1234.5, -0.25, 7.0, None, None, None]
+
+
+def test_build_arrow_table_types_columns():
+    dados = [
+        ["Financ e Outros", "AAA3", "ACAO A", "ON NM", "1.234.567", "12,345", "12,345"],
+        ["Petroleo", "BBB4", "ACAO B", "PN N1", "", "inválido", "100,000"],
+    ]
+
+    table = app.build_arrow_table(dados, app.COLUNAS, '18-10-26')
+
+    assert table.schema == app.parquet_schema()
+    assert table.column('Qtde. Teórica').to_pylist() == [1234567, None]
+    assert table.column('Part. (%)').to_pylist() == [12.345, None]
+    assert table.column('Dia').type == pa.date32()
+    assert table.column('Dia').to_pylist() == [datetime.date(2026, 10, 18)] * 2
+    assert pa.types.is_dictionary(table.column('Setor').type)
+    assert table.column('Tipo').to_pylist() == ['ON NM', 'PN N1']
+
+
+def test_build_arrow_table_without_rows_or_date():
+    vazia = app.build_arrow_table([], app.COLUNAS, '18-10-26')
+    sem_data = app.build_arrow_table([["S", "AAA3", "A", "ON", "1", "1,0", "1,0"]], app.COLUNAS, None)
+
+    assert vazia.num_rows == 0 and vazia.schema == app.parquet_schema()
+    assert sem_data.column('Dia').to_pylist() == [None]
@@ -0,0 +1,96 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import app
+
+
+def test_async_batch_with_warm_sync_playwright(s3, replica):
+    # Browser síncrono de uma invocação anterior ainda vivo no container
+    app._browser['playwright'] = app.lazy_import('playwright.sync_api').sync_playwright().start()
+
+    response = app.lambda_handler({'mode': 'http', 'indices': ['IBOV', 'SMLL']}, None)
+
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert [r['status'] for r in body['results']] == ['ok', 'ok']
+
+
+def test_default_index_shares_the_single_run_filename(s3, replica):
+    assert app.dataset_filename('18-10-26', app.DEFAULT_INDEX) == app.dataset_filename('18-10-26')
+
+    app.lambda_handler({'mode': 'http'}, None)
+    response = app.lambda_handler({'mode': 'http', 'indices': [app.DEFAULT_INDEX]}, None)
+
+    body = json.loads(response['body'])
+    assert [r['status'] for r in body['results']] == ['skipped']
+
+
+def test_default_run_replays_default_index(s3, replica):
+    # Última requisição capturada foi de outro índice (ex.: lote em pipeline)
+    app.store_portfolio_request(replica.api_url('SMLL'), {})
+
+    assert app.probe_portfolio_date() is not None
+    app.lambda_handler({'mode': 'http', 'force': True}, None)
+
+    assert set(replica.api_indices) == {app.DEFAULT_INDEX}
+
+
+def test_async_batch_builds_tables_inside_normalization_span(s3, replica):
+    response = app.lambda_handler({'mode': 'http', 'indices': ['IBOV', 'SMLL']}, None)
+
+    assert json.loads(response['body'])['spans']['normalization']['count'] == 2
+
+
+class CapturedResponse:
+    def __init__(self, url, payload):
+        self.url = url
+        self.ok = True
+        self.request = SimpleNamespace(headers={'referer': 'https://b3', 'cookie': 'x'})
+        self.payload = payload
+
+    async def json(self):
+        return self.payload
+
+
+class CapturingPage:
+    """
+    Página falsa: a navegação dispara a resposta da API da carteira
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.handlers = []
+
+    def set_default_timeout(self, timeout):
+        pass
+
+    def on(self, evento, handler):
+        self.handlers.append(handler)
+
+    async def goto(self, url, wait_until=None):
+        for handler in self.handlers:
+            handler(self.response)
+
+    async def close(self):
+        pass
+
+
+def test_async_capture_records_the_portfolio_request(replica):
+    response = CapturedResponse(replica.api_url('SMLL'), replica.portfolio_payload({'pageSize': 120}))
+    page = CapturingPage(response)
+
+    async def get_context():
+        async def new_page():
+            return page
+        return SimpleNamespace(new_page=new_page)
+
+    captured = {}
+    dados, _, _ = asyncio.run(app.scrape_index_async(get_context, 'SMLL', 'capture', {}, captured))
+
+    assert len(dados) == 30
+    assert captured['url'] == replica.api_url('SMLL')
+    # O lote guarda a requisição como read_portfolio_capture (só cabeçalhos repetíveis)
+    stored = app.store_portfolio_request(captured['url'], captured['headers'])
+    assert stored['headers'] == {'referer': 'https://b3'}
+    assert app.load_portfolio_request() == stored
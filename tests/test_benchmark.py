@@ -0,0 +1,52 @@
+import json
+
+import benchmark
+
+
+def resultado(**campos):
+    base = {
+        'mode': 'dom', 'expected_rows': 90, 'latency_ms': 50, 'layout': 'iframe', 'profile': 'robust',
+        'rows': 90,
+        'phases_seconds': {'scrape': 1.0, 'normalize': 0.01},
+        'total_seconds': 1.01,
+        'browser_roundtrips': 40,
+        'site_requests': {'page': 2, 'frame': 1, 'api': 6, 'other': 0},
+    }
+    base.update(campos)
+    return base
+
+
+def test_baseline_is_keyed_by_configuration(tmp_path):
+    path = tmp_path / 'baseline.json'
+    benchmark.update_baseline(resultado(), path)
+    benchmark.update_baseline(resultado(mode='http', browser_roundtrips=0), path)
+
+    assert sorted(json.loads(path.read_text())) == [
+        'dom:90:50ms:iframe:robust', 'http:90:50ms:iframe:robust']
+    assert benchmark.check_baseline(resultado(), path) == []
+    assert benchmark.check_baseline(resultado(expected_rows=250), path) is None
+
+
+def test_check_baseline_reports_regressions(tmp_path):
+    path = tmp_path / 'baseline.json'
+    benchmark.update_baseline(resultado(), path)
+
+    regressoes = benchmark.check_baseline(resultado(
+        rows=80,
+        phases_seconds={'scrape': 1.5, 'normalize': 0.02},
+        total_seconds=1.52,
+        browser_roundtrips=41,
+        site_requests={'page': 2, 'frame': 1, 'api': 7, 'other': 0},
+    ), path)
+
+    assert [r.split(':')[0] for r in regressoes] == [
+        'rows', 'total_seconds', 'scrape', 'browser_roundtrips', 'site_requests.api']
+
+
+def test_check_baseline_tolerates_small_slowdowns(tmp_path):
+    path = tmp_path / 'baseline.json'
+    benchmark.update_baseline(resultado(), path)
+
+    # +20% em scrape e +100% em uma fase de milissegundos (abaixo de 50 ms)
+    assert benchmark.check_baseline(resultado(
+        phases_seconds={'scrape': 1.2, 'normalize': 0.02}, total_seconds=1.22), path) == []
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import app
+
+
+class CapturedResponse:
+    def __init__(self, url, payload):
+        self.url = url
+        self.request = SimpleNamespace(headers={'accept': 'application/json'})
+        self.payload = payload
+        self.json_calls = 0
+
+    def json(self):
+        self.json_calls += 1
+        return self.payload
+
+
+def test_captured_json_is_parsed_once(replica):
+    response = CapturedResponse(replica.api_url(), replica.portfolio_payload({'pageSize': 120}))
+
+    dados, data_formatada, resumo = app.read_portfolio_capture([response])
+
+    assert len(dados) == 30
+    assert data_formatada == '18-10-26'
+    assert resumo['expected_rows'] == 30
+    assert response.json_calls == 1
@@ -0,0 +1,92 @@
+import json
+
+import pyarrow.parquet as pq
+import pytest
+
+import app
+
+PARTITION = 'data/index=IBOV/year=2026/month=10/'
+
+
+@pytest.fixture(autouse=True)
+def partitioned(monkeypatch):
+    monkeypatch.setattr(app, 'DATASET_LAYOUT', 'partitioned')
+
+
+def rows(*codigos, qtde='1.000'):
+    return [["Financ e Outros", codigo, f"ACAO {codigo}", "ON NM", qtde, "1,000", "1,000"]
+            for codigo in codigos]
+
+
+def store(dados, data_formatada, index=None):
+    filename = app.dataset_filename(data_formatada, index)
+    app.store_dataset_file(dados, app.COLUNAS, filename, data_formatada)
+    return app.DATASET_PREFIX + filename
+
+
+def read(dataset, key):
+    return pq.read_table(dataset / key).to_pylist()
+
+
+def test_partitioned_writer_uses_hive_paths(dataset):
+    assert store(rows('AAA3'), '01-10-26') == PARTITION + 'b3_data_01-10-26.parquet'
+    assert store(rows('ZZZ3'), '01-10-26', 'SMLL') == \
+        'data/index=SMLL/year=2026/month=10/b3_data_01-10-26.parquet'
+    assert (dataset / PARTITION / 'b3_data_01-10-26.parquet').exists()
+
+
+def test_compaction_merges_and_deletes_dailies(dataset):
+    store(rows('BBB3', 'AAA3'), '02-10-26')
+    store(rows('AAA3', 'BBB3'), '01-10-26')
+    store(rows('ZZZ3'), '01-10-26', 'SMLL')
+
+    resultado = app.compact_partition(PARTITION)
+
+    assert resultado['compacted'] and resultado['rows'] == 4
+    assert sorted(p.name for p in (dataset / PARTITION).iterdir()) == ['compacted.parquet']
+    linhas = read(dataset, PARTITION + 'compacted.parquet')
+    assert [(str(l['Dia']), l['Código']) for l in linhas] == [
+        ('2026-10-01', 'AAA3'), ('2026-10-01', 'BBB3'),
+        ('2026-10-02', 'AAA3'), ('2026-10-02', 'BBB3'),
+    ]
+    # Outro índice no mesmo dia fica intacto
+    assert (dataset / 'data/index=SMLL/year=2026/month=10/b3_data_01-10-26.parquet').exists()
+
+
+def test_new_daily_after_compaction_replaces_its_day(dataset):
+    store(rows('AAA3', 'BBB3'), '01-10-26')
+    store(rows('AAA3', 'BBB3'), '02-10-26')
+    app.compact_partition(PARTITION)
+
+    # Dia regravado depois da compactação (com outra carteira) e um dia novo
+    store(rows('CCC3', qtde='2.000'), '02-10-26')
+    store(rows('AAA3'), '03-10-26')
+    resultado = app.compact_partition(PARTITION)
+
+    assert resultado['rows'] == 4
+    assert sorted(p.name for p in (dataset / PARTITION).iterdir()) == ['compacted.parquet']
+    linhas = read(dataset, PARTITION + 'compacted.parquet')
+    assert [(str(l['Dia']), l['Código'], l['Qtde. Teórica']) for l in linhas] == [
+        ('2026-10-01', 'AAA3', 1000), ('2026-10-01', 'BBB3', 1000),
+        ('2026-10-02', 'CCC3', 2000), ('2026-10-03', 'AAA3', 1000),
+    ]
+
+
+def test_compaction_rejects_prefixes_outside_a_partition(dataset, monkeypatch):
+    monkeypatch.setattr(app, 'DATASET_LAYOUT', 'flat')
+    store(rows('AAA3'), '01-10-26')
+    store(rows('ZZZ3'), '01-10-26', 'SMLL')
+
+    for prefix in ('data/', 'data/index=IBOV/', 'data/index=../year=2026/month=10/'):
+        with pytest.raises(ValueError):
+            app.compact_partition(prefix)
+
+    # O prefixo livre do evento não é mais aceito: compacta só a partição pedida
+    response = app.lambda_handler({'action': 'compact', 'prefix': 'data/', 'year': 2026, 'month': 10}, None)
+    assert json.loads(response['body'])['compacted'] is False
+    assert sorted(p.name for p in (dataset / 'data').iterdir() if p.is_file()) == [
+        'b3_data_01-10-26.parquet', 'b3_data_SMLL_01-10-26.parquet',
+    ]
+
+    response = app.lambda_handler({'action': 'compact', 'year': 'x', 'month': 10}, None)
+    assert response['statusCode'] == 400
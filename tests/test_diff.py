@@ -0,0 +1,96 @@
+import pytest
+
+import app
+
+
+def rows(*itens):
+    return [["Financ e Outros", codigo, f"ACAO {codigo}", "ON NM", qtde, part, "1,000"]
+            for codigo, qtde, part in itens]
+
+
+BASE = rows(('AAA3', '1.000', '10,000'), ('BBB3', '2.000', '20,000'), ('CCC3', '3.000', '30,000'))
+
+
+def ingest(dados, data_formatada):
+    """
+    Grava o snapshot do dia e compara com o anterior, como o handler
+    """
+    filename = app.dataset_filename(data_formatada)
+    table = app.build_arrow_table(dados, app.COLUNAS, data_formatada)
+    app.store_dataset_file(dados, app.COLUNAS, filename, data_formatada, table)
+    return app.diff_with_previous(table, filename, data_formatada)
+
+
+def test_composition_delta_classifies_changes():
+    anterior = app.build_arrow_table(BASE, app.COLUNAS, '01-10-26')
+    atual = app.build_arrow_table(
+        rows(('AAA3', '1.000', '10,000'), ('BBB3', '2.500', '20,000'), ('DDD3', '4.000', '40,000')),
+        app.COLUNAS, '02-10-26')
+
+    delta = app.composition_delta(anterior, atual).to_pylist()
+
+    assert [(d['Código'], d['Mudança']) for d in delta] == [
+        ('DDD3', 'entrada'), ('BBB3', 'peso'), ('CCC3', 'saida')]
+    peso = delta[1]
+    assert (peso['Qtde. Teórica anterior'], peso['Qtde. Teórica'], peso['Variação Qtde.']) == (2000, 2500, 500)
+    assert str(delta[2]['Dia']) == '2026-10-02' and str(delta[0]['Dia anterior']) == '2026-10-01'
+
+
+def test_identical_snapshots_have_empty_delta():
+    anterior = app.build_arrow_table(BASE, app.COLUNAS, '01-10-26')
+    atual = app.build_arrow_table(BASE, app.COLUNAS, '02-10-26')
+
+    assert app.composition_delta(anterior, atual).num_rows == 0
+
+
+def test_previous_snapshot_from_dataset(dataset, tmp_path, monkeypatch):
+    ingest(BASE, '01-10-26')
+    # Container frio: cache local vazio
+    monkeypatch.setattr(app, 'SNAPSHOT_CACHE_DIR', str(tmp_path / 'cold'))
+
+    diff = ingest(rows(('AAA3', '1.000', '10,000')), '02-10-26')
+
+    assert diff['previous_date'] == '01-10-26'
+    assert diff['previous_source'] == 'dataset'
+    assert (diff['removed'], diff['changed']) == (2, True)
+    assert (dataset / 'data' / 'b3_delta_02-10-26.parquet').exists()
+
+
+def test_previous_snapshot_from_warm_cache(dataset):
+    ingest(BASE, '01-10-26')
+
+    diff = ingest(BASE, '02-10-26')
+
+    assert diff['previous_source'] == 'cache'
+    assert (diff['previous_date'], diff['changed']) == ('01-10-26', False)
+
+
+def test_stale_cache_is_ignored_when_dataset_has_a_newer_day(dataset, tmp_path, monkeypatch):
+    # Este container viu 01-10; outro container ingeriu 02-10 com outra carteira
+    ingest(BASE, '01-10-26')
+    outro = rows(('AAA3', '1.000', '10,000'))
+    monkeypatch.setattr(app, 'SNAPSHOT_CACHE_DIR', str(tmp_path / 'other_container'))
+    ingest(outro, '02-10-26')
+    monkeypatch.setattr(app, 'SNAPSHOT_CACHE_DIR', str(tmp_path / 'snapshots'))
+
+    diff = ingest(outro, '05-10-26')
+
+    assert diff['previous_source'] == 'dataset'
+    assert (diff['previous_date'], diff['changed']) == ('02-10-26', False)
+
+
+@pytest.mark.parametrize('warm', [False, True])
+def test_previous_snapshot_from_compacted_partition(dataset, tmp_path, monkeypatch, warm):
+    monkeypatch.setattr(app, 'DATASET_LAYOUT', 'partitioned')
+    ingest(BASE, '29-09-26')
+    ingest(rows(('AAA3', '1.000', '10,000')), '30-09-26')
+    app.compact_partition(app.partition_prefix('IBOV', 2026, 9))
+    if not warm:
+        monkeypatch.setattr(app, 'SNAPSHOT_CACHE_DIR', str(tmp_path / 'cold'))
+
+    diff = ingest(BASE, '01-10-26')
+
+    # Um compactado do mês do cache pode ter um dia mais novo: vale o dataset
+    assert diff['previous_source'] == 'dataset'
+    assert diff['previous_date'] == '30-09-26'
+    assert diff['added'] == 2
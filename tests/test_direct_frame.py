@@ -0,0 +1,18 @@
+import app
+
+
+def test_learned_frame_src_only_for_its_index(monkeypatch):
+    monkeypatch.setattr(app, 'FRAME_URL', None)
+    strategy = {'frame_src': 'https://x.b3.com.br/frame/IBOV', 'frame_index': 'IBOV'}
+
+    assert app.direct_frame_url(strategy) == strategy['frame_src']
+    assert app.direct_frame_url(strategy, 'SMLL') is None
+
+
+def test_pinned_frame_url_is_index_aware(monkeypatch):
+    monkeypatch.setattr(app, 'FRAME_URL', 'https://x.b3.com.br/frame/IBOV')
+    assert app.direct_frame_url({}, 'IBOV') == 'https://x.b3.com.br/frame/IBOV'
+    assert app.direct_frame_url({}, 'SMLL') is None
+
+    monkeypatch.setattr(app, 'FRAME_URL', 'https://x.b3.com.br/frame/{index}')
+    assert app.direct_frame_url({}, 'SMLL') == 'https://x.b3.com.br/frame/SMLL'
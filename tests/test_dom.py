@@ -0,0 +1,75 @@
+import pytest
+
+import app
+import benchmark
+
+
+def portfolio_rows(replica):
+    return [[r['segment'], r['cod'], r['asset'], r['type'], r['theoricalQty'], r['part'], r['partAcum']]
+            for r in replica.results]
+
+
+def test_parse_dom_footer_reads_totals():
+    rows = [
+        ['Quantidade Teórica Total', '5.055.551.865', '100,000', ''],
+        ['Redutor', '15.432.123,45678901', '', ''],
+        ['Outra linha', '1'],
+    ]
+
+    assert app.parse_dom_footer(rows) == {'qtde_total': 5055551865.0, 'redutor': 15432123.45678901}
+    assert app.parse_dom_footer([['Quantidade Teórica Total', '', '']]) == {}
+
+
+def test_check_completeness_against_footer():
+    with benchmark.ReplicaServer(rows=30, latency_ms=0) as replica:
+        dados = portfolio_rows(replica)
+        resumo = app.parse_dom_footer([
+            ['Quantidade Teórica Total', replica.header['theoricalQty'], replica.header['part']],
+            ['Redutor', replica.header['reductor']],
+        ])
+
+    completo = app.check_completeness(dados, dict(resumo, expected_rows=30))
+    faltando = app.check_completeness(dados[:-1], resumo)
+
+    assert completo['complete'] is True
+    assert completo['qtde_sum'] == completo['qtde_total']
+    assert faltando['complete'] is False
+    assert app.check_completeness(dados, {})['complete'] is None
+
+
+def test_dedupe_rows_by_codigo():
+    dados = [['S', 'AAA3', 'A'], ['S', 'BBB3', 'B'], ['S', 'AAA3', 'A repetida']]
+
+    assert app.dedupe_rows(dados) == [['S', 'AAA3', 'A'], ['S', 'BBB3', 'B']]
+
+
+@pytest.fixture
+def large_replica(monkeypatch):
+    """
+    Réplica com mais linhas que o maior tamanho de página (120): força a
+    paginação pelo botão "próxima"
+    """
+    with benchmark.ReplicaServer(rows=250, latency_ms=0) as server:
+        monkeypatch.setattr(app, 'B3_BASE_URL', server.base_url)
+        monkeypatch.setattr(app, 'ALLOWED_DOMAINS', app.ALLOWED_DOMAINS | {'127.0.0.1'})
+        yield server
+
+
+def test_dom_pagination_collects_every_page(browser, large_replica):
+    dados, _, _ = app.scrape_b3_data('dom')
+
+    assert len(dados) == 250
+    assert len({linha[1] for linha in dados}) == 250
+    assert app._completeness['complete'] is True
+
+
+def test_dom_pagination_dedupes_and_flags_footer_mismatch(browser, large_replica):
+    # Código repetido em outra página e rodapé que não bate com as linhas
+    large_replica.results[130] = dict(large_replica.results[5])
+    large_replica.header['theoricalQty'] = '1.000'
+
+    dados, _, _ = app.scrape_b3_data('dom')
+
+    assert len(dados) == 249
+    assert [linha[1] for linha in dados].count(large_replica.results[5]['cod']) == 1
+    assert app._completeness['complete'] is False
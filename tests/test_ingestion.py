@@ -0,0 +1,68 @@
+import json
+import os
+
+import app
+
+
+def handler(**event):
+    response = app.lambda_handler(dict(event, mode='http'), None)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+
+def test_unchanged_content_skips_upload(s3, replica):
+    assert handler()['upload'] == 'uploaded'
+
+    assert handler(force=True)['upload'] == 'unchanged'
+
+
+def test_existing_key_skips_scrape(s3, replica):
+    handler()
+    api_calls = replica.requests['api']
+
+    body = handler()
+
+    assert body['skipped'] == 'already_ingested'
+    # Só a sonda de data foi feita
+    assert replica.requests['api'] == api_calls + 1
+
+
+def test_force_bypasses_ingestion_check(s3, replica):
+    handler()
+
+    body = handler(force=True)
+
+    assert 'skipped' not in body
+    assert body['s3_path'].endswith('.parquet')
+
+
+def test_cold_container_probes_with_request_from_bucket(s3, replica):
+    handler()
+    # Container frio: /tmp vazio, requisição só no bucket
+    os.remove(app.PORTFOLIO_REQUEST_CACHE)
+
+    body = handler()
+
+    assert body['skipped'] == 'already_ingested'
+
+
+def test_normalization_and_serialization_spans_are_distinct(s3, replica):
+    spans = handler()['spans']
+
+    assert spans['normalization']['count'] == 1
+    assert spans['serialization']['count'] == 1
+
+
+def test_head_object_forbidden_does_not_block_upload(s3, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    def forbidden(**kwargs):
+        raise ClientError({'Error': {'Code': '403', 'Message': 'Forbidden'}}, 'HeadObject')
+
+    monkeypatch.setattr(s3, 'head_object', forbidden)
+    dados = [["Financ e Outros", "AAA3", "ACAO", "ON NM", "1.000", "1,000", "1,000"]]
+
+    destino = app.save_to_parquet(dados, app.COLUNAS, 'b3_data_01-10-26.parquet', '01-10-26')
+
+    assert destino == 's3://b3-scraper-tests/data/b3_data_01-10-26.parquet'
+    s3.get_object(Bucket='b3-scraper-tests', Key='data/b3_data_01-10-26.parquet')
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import app
+
+
+def request(url, resource_type='document'):
+    return SimpleNamespace(url=url, resource_type=resource_type)
+
+
+def test_domain_allowed_accepts_subdomains_only(monkeypatch):
+    monkeypatch.setattr(app, 'ALLOWED_DOMAINS', {'b3.com.br'})
+
+    assert app.domain_allowed('b3.com.br')
+    assert app.domain_allowed('sistemaswebb3-listados.b3.com.br')
+    assert not app.domain_allowed('notb3.com.br')
+    assert not app.domain_allowed('www.google-analytics.com')
+
+
+def test_block_reason_counts_allowed_and_blocked(monkeypatch):
+    monkeypatch.setattr(app, 'ALLOWED_DOMAINS', {'b3.com.br'})
+    monkeypatch.setattr(app, 'BLOCKED_RESOURCE_TYPES', {'image', 'font'})
+    stats = app.new_network_stats()
+
+    assert app.block_reason(request('https://x.b3.com.br/api'), stats) is None
+    assert app.block_reason(request('https://x.b3.com.br/logo.png', 'image'), stats) == ('blocked_by_type', 'image')
+    assert app.block_reason(request('https://cdn.tracker.io/t.js', 'script'), stats) == \
+        ('blocked_by_domain', 'cdn.tracker.io')
+
+    assert (stats['allowed'], stats['blocked']) == (1, 2)
+    assert stats['blocked_by_type'] == {'image': 1}
+    assert stats['blocked_by_domain'] == {'cdn.tracker.io': 1}
+
+
+def test_response_bytes_use_body_size_without_content_length():
+    stats = app.new_network_stats()
+
+    # Resposta chunked/comprimida: sem content-length, tamanho vem de sizes()
+    app.count_response_bytes(stats, {'responseBodySize': 5120}, {'transfer-encoding': 'chunked'})
+    # Tamanho indisponível: content-length como reserva
+    app.count_response_bytes(stats, {'responseBodySize': -1}, {'content-length': '100'})
+    app.count_response_bytes(stats, None, {'content-length': '20'})
+
+    assert stats['allowed_bytes'] == 5240
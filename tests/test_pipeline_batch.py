@@ -0,0 +1,43 @@
+import json
+
+import app
+
+
+def run_pipeline(indices, **event):
+    response = app.lambda_handler(dict(event, indices=indices, batch_mode='pipeline'), None)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+
+def test_pipeline_saves_each_index(s3, replica):
+    body = run_pipeline(['IBOV', 'SMLL'], mode='http')
+
+    assert [r['status'] for r in body['results']] == ['ok', 'ok']
+    assert body['summary']['ok'] == 2
+    keys = [o['Key'] for o in s3.list_objects_v2(Bucket='b3-scraper-tests')['Contents']]
+    assert len([k for k in keys if 'b3_data_' in k]) == 2
+
+
+def test_pipeline_reports_scrape_failures(s3, replica, monkeypatch):
+    def falha():
+        raise RuntimeError('browser indisponível')
+    monkeypatch.setattr(app, 'acquire_browser_context', falha)
+
+    body = run_pipeline(['IBOV'], mode='dom')
+
+    resultado = body['results'][0]
+    assert resultado['status'] == 'error'
+    assert resultado['stage'] == 'scrape'
+    assert 'browser indisponível' in resultado['error']
+    assert body['summary']['error'] == 1
+
+
+def test_pipeline_network_stats_cover_the_whole_batch(s3, replica, monkeypatch):
+    def uma_requisicao():
+        app._network_stats['allowed'] += 1
+        raise RuntimeError('browser indisponível')
+    monkeypatch.setattr(app, 'acquire_browser_context', uma_requisicao)
+
+    body = run_pipeline(['IBOV', 'SMLL', 'IDIV'], mode='dom')
+
+    assert body['network']['allowed'] == 3
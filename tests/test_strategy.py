@@ -0,0 +1,88 @@
+import json
+
+import app
+import benchmark
+
+
+class FakePage:
+    """
+    Página falsa para a extração: TABLE_ROWS_JS lê a tabela da estratégia,
+    TABLES_JS devolve todas as tabelas e DATE_JS procura os seletores de título
+    """
+
+    def __init__(self, tabelas, titulos):
+        self.tabelas = tabelas
+        self.titulos = titulos
+        self.calls = []
+
+    def evaluate(self, script, arg=None):
+        self.calls.append(script)
+        if script == app.TABLE_ROWS_JS:
+            index, row_selector = arg
+            if index >= len(self.tabelas):
+                return []
+            return self.tabelas[index][app.ROW_SELECTORS.index(row_selector)]
+        if script == app.TABLES_JS:
+            return self.tabelas
+        if script == app.DATE_JS:
+            for seletor in arg:
+                if seletor in self.titulos:
+                    return [seletor, self.titulos[seletor]]
+            return None
+        raise AssertionError(f"script inesperado: {script[:40]}")
+
+
+def fixture_page():
+    tabelas = app.parse_tables_html(benchmark.build_fixture_html(30))
+    return FakePage(tabelas, {'form h2': 'Carteira do Dia - 18/10/26'})
+
+
+def test_valid_cached_table_skips_full_search():
+    page = fixture_page()
+    strategy = {}
+    app.extract_table_rows(page, 'evaluate', strategy)
+    page.calls.clear()
+
+    dados = app.extract_table_rows(page, 'evaluate', strategy)
+
+    assert len(dados) == 30
+    assert page.calls == [app.TABLE_ROWS_JS]
+
+
+def test_stale_cached_table_falls_back_to_full_search():
+    page = fixture_page()
+    strategy = {'table': {'index': 0, 'rows': 'tbody tr', 'cells': 9}}
+
+    dados = app.extract_table_rows(page, 'evaluate', strategy)
+
+    assert len(dados) == 30
+    assert page.calls == [app.TABLE_ROWS_JS, app.TABLES_JS]
+    assert strategy['table']['cells'] == 7
+
+
+def test_stale_date_selector_falls_back_to_full_search():
+    page = fixture_page()
+    strategy = {'date_selector': '#titulo-antigo'}
+
+    assert app.extract_date(page, strategy) == '18-10-26'
+    assert strategy['date_selector'] == 'form h2'
+    assert page.calls == [app.DATE_JS, app.DATE_JS]
+
+
+def test_strategy_is_rewritten_only_when_it_changes(monkeypatch):
+    gravadas = []
+    monkeypatch.setattr(app, 'store_page_strategy', gravadas.append)
+    page = fixture_page()
+    strategy = {'date_selector': '#titulo-antigo', 'table': {'index': 0, 'rows': 'tbody tr', 'cells': 9}}
+
+    antes = dict(strategy)
+    app.extract_date(page, strategy)
+    app.extract_table_rows(page, 'evaluate', strategy)
+    assert app.update_page_strategy(strategy, antes) is True
+
+    antes = json.loads(json.dumps(strategy))
+    app.extract_date(page, strategy)
+    app.extract_table_rows(page, 'evaluate', strategy)
+    assert app.update_page_strategy(strategy, antes) is False
+
+    assert gravadas == [strategy]